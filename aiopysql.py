@@ -0,0 +1,351 @@
+'''
+Асинхронный клиент базы данных PostgreSQL на драйвере asyncpg
+'''
+import asyncio
+import logging
+
+import asyncpg
+
+from cache import ClientCache
+from cache import lookup_key
+from queries import STATEMENTS
+from records import FIELDS
+from records import Client
+from records import Phone
+from records import copy_client
+from validation import validate_numbers
+
+
+class AsyncPySQL:
+    '''
+    Асинхронный класс для работы с базой данных PostgreSQL
+    Методы add_client, add_phone, change_client, delete_phone, delete_client,
+    find_client и find_clients повторяют одноименные методы класса PySQL
+    и принимают такой же словарь params (см. main.py)
+    Соединения выдаются из асинхронного пула asyncpg:
+        min_size, max_size - границы размера пула
+        max_idle - время простоя (сек), после которого соединение закрывается
+    Подготовленные на сервере запросы кэшируются драйвером для каждого соединения
+    Результаты find_client могут кэшироваться (cache_size, cache_ttl - см. PySQL)
+    Методы принимают и записи Client и Phone, а при records = True методы поиска
+    возвращают записи Client вместо словарей (см. records.py)
+    Пул создается методом connect или при входе в блок async with:
+        async with AsyncPySQL(database, user, password) as apysql:
+            await apysql.find_client(params)
+    '''
+    def __init__(self, database:str, user:str, password:str,
+                 min_size=1, max_size=10, max_idle=300, cache_size=0, cache_ttl=60,
+                 records=False):
+        self.database = database
+        self.user = user
+        self.password = password
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.cache = ClientCache(cache_size, cache_ttl) if cache_size else None
+        self.records = records
+        self.pool = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    async def connect(self):
+        '''
+        Функция создания пула соединений с базой данных
+        '''
+        self.pool = await asyncpg.create_pool(database=self.database,
+                                              user=self.user,
+                                              password=self.password,
+                                              min_size=self.min_size,
+                                              max_size=self.max_size,
+                                              max_inactive_connection_lifetime=self.max_idle)
+        logging.info('Успешное подключение к базе данных "%s". '
+                     'Асинхронный пул соединений создан (%s-%s)',
+                     self.database, self.min_size, self.max_size)
+        return self
+
+    async def close(self):
+        '''
+        Функция закрытия пула соединений
+        '''
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            logging.info('Асинхронный пул соединений с базой данных "%s" закрыт', self.database)
+
+    def pool_stats(self) -> dict:
+        '''
+        Функция получения статистики пула соединений
+        '''
+        return {'size': self.pool.get_size(),
+                'idle': self.pool.get_idle_size(),
+                'in_use': self.pool.get_size() - self.pool.get_idle_size(),
+                'minconn': self.pool.get_min_size(),
+                'maxconn': self.pool.get_max_size()}
+
+    def cache_stats(self) -> dict:
+        '''
+        Функция получения статистики кэша find_client (None, если кэш отключен)
+        '''
+        return self.cache.stats() if self.cache is not None else None
+
+    def _record(self, client_id, name, surname, mail, number):
+        '''
+        Функция создания результата поиска: записи Client или словаря
+        '''
+        if self.records:
+            return Client(client_id, name, surname, mail, number)
+        return dict(zip(FIELDS, (client_id, name, surname, mail, number)))
+
+    def _invalidate(self, *keys):
+        '''
+        Функция удаления из кэша записей о клиентах, затронутых изменением
+        '''
+        if self.cache is not None:
+            self.cache.invalidate(*keys)
+
+    async def add_client(self, params:dict):
+        '''
+        Функция добавления информации о клиенте (см. PySQL.add_client)
+        '''
+        logging.info('Запуск функции (add_client) '
+                     'добавления информации: %s', params)
+        try:
+            name = params['name']
+            surname = params['surname']
+            mail = params['mail']
+            numbers = params.get('number')
+        except KeyError:
+            logging.warning("Ошибка ввода данных - "
+                            "параметры 'name', 'surname' и 'mail' являются обязательными")
+            return
+        try:
+            async with self.pool.acquire() as connection:
+                client_id = await connection.fetchval(STATEMENTS['pysql_insert_client'],
+                                                      name.title(), surname.title(), mail)
+        except asyncpg.UniqueViolationError:
+            logging.warning('Адрес почты %s уже существует в базе данных', mail)
+            return
+        logging.info('SUCCESS: Информация о клиенте %s %s добавлена в таблицу '
+                     '"client". Идентификатор клиента - %s', surname, name, client_id)
+        if numbers:
+            params = {'new_number': numbers}
+            await self.add_phone(params, _existance=client_id)
+
+    async def add_phone(self, params:dict, _existance=None):
+        '''
+        Функция добавления номера телефона (см. PySQL.add_phone)
+        '''
+        logging.info('Запуск функции (add_phone) '
+                     'добавления номера телефона: %s', params)
+        match params:
+            case Phone(number=number, client_id=client_id):
+                numbers, params = [number], {'client_id': client_id}
+            case Client(number=numbers):
+                params = Client(params.client_id, params.name, params.surname, params.mail)
+            case _:
+                numbers = params.get('new_number')
+        client_id = _existance if _existance else await self.find_client(params, _id_only=True)
+        if not client_id:
+            return
+        if isinstance(numbers, (int, str)):
+            numbers = [numbers]
+        checked = validate_numbers(numbers or [])
+        denial = [f'{value} ({reason})' for _, value, reason in checked.rejected]
+        phones = []
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                for number in checked.clean:
+                    if await connection.fetchval(STATEMENTS['pysql_insert_phone'],
+                                                 client_id, number):
+                        phones.append(number)
+                    else:
+                        logging.warning('Номер %s уже существует в базе данных', number)
+        if denial:
+            logging.warning('Ошибка ввода номера(ов) '
+                            'для добавления: %s', ', '.join(map(str, denial)))
+        if phones:
+            self._invalidate(('client_id', client_id))
+            logging.info('SUCCESS: Номер(а) %s '
+                         'добавлен(ы) в таблицу "phone"', ', '.join(map(str, phones)))
+
+    async def change_client(self, params:dict, changes=None):
+        '''
+        Функция изменения данных о клиенте (см. PySQL.change_client)
+        Конфликты отдельных изменений обрабатываются точками сохранения
+        (вложенными транзакциями asyncpg), все изменения фиксируются одной транзакцией
+        '''
+        logging.info('Запуск функции (change_client) '
+                     'изменения информации: %s %s', params, changes or '')
+        client_id = await self.find_client(params, _id_only=True)
+        if not client_id:
+            return
+        source, prefix = (params, 'new_') if changes is None else (changes, '')
+        new_params = {key: value for key in ('name', 'surname', 'mail', 'number')
+                      if (value := source.get(prefix + key))}
+        if isinstance(new_params.get('number'), list):
+            new_params['number'] = new_params['number'][0]
+        if isinstance(old_number := params.get('number'), list):
+            old_number = old_number[0] if old_number else None
+        flag = 0
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                for key, value in new_params.items():
+                    if key == 'number':
+                        if not old_number:
+                            logging.warning('Не указан заменяемый номер телефона (number)')
+                            continue
+                        if (number := validate_numbers([value]).values[0]) is None:
+                            logging.warning('Ошибка ввода номера: %s', value)
+                            continue
+                        if phone_id := await connection.fetchval(
+                                STATEMENTS['pysql_select_phone_id'], str(old_number)):
+                            try:
+                                async with connection.transaction():
+                                    await connection.execute(STATEMENTS['pysql_update_phone'],
+                                                             number, phone_id)
+                                flag += 1
+                            except asyncpg.UniqueViolationError:
+                                logging.warning('Номер %s уже существует в '
+                                                'базе данных', number)
+                    else:
+                        try:
+                            async with connection.transaction():
+                                await connection.execute(
+                                    STATEMENTS[f'pysql_update_client_{key}'], value, client_id)
+                            flag += 1
+                        except asyncpg.UniqueViolationError:
+                            logging.warning('Адрес почты %s уже существует в базе данных', value)
+        if flag:
+            self._invalidate(('client_id', client_id),
+                             *([('number', str(old_number))] if old_number else []))
+            logging.info('SUCCESS: Информация о клиенте обновлена')
+
+    async def delete_phone(self, params:dict, _all_numbers=False):
+        '''
+        Функция удаления телефона (см. PySQL.delete_phone)
+        '''
+        if _all_numbers:
+            client_id = params
+            logging.info('Запуск функции (delete_phone) удаления '
+                         'всех номеров телефона по идентификатору: %s', client_id)
+            async with self.pool.acquire() as connection:
+                deleted = await connection.fetch(STATEMENTS['pysql_delete_client_phones'],
+                                                 client_id)
+            if deleted:
+                self._invalidate(('client_id', client_id))
+                logging.info('SUCCESS: Информация о номерах телефона клиента '
+                             '(%s) удалена из таблицы "phone"', client_id)
+            else:
+                logging.info('Информация о номерах телефона клиента (%s) '
+                             'не найдена', client_id)
+            return
+        if not (numbers := (params.number if isinstance(params, Phone)
+                            else params.get('number'))):
+            logging.warning('Ошибка входных данных: %s', numbers)
+            return
+        if isinstance(numbers, (int, str)):
+            numbers = [numbers]
+        logging.info('Запуск функции (delete_phone) удаления '
+                     'номеров телефона: %s', params)
+        phones = []
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                for number in numbers:
+                    if phone := await connection.fetchval(STATEMENTS['pysql_delete_phone'],
+                                                          str(number)):
+                        phones.append(phone)
+        if phones:
+            self._invalidate(*(('number', number) for number in phones))
+            logging.info('SUCCESS: Из таблицы "phone" удален(ы) номер(а): %s', ' '.join(phones))
+        else:
+            logging.info('В таблице "phone" данные номера отсутствуют')
+
+    async def delete_client(self, params:dict):
+        '''
+        Функция удаления информации о клиенте (см. PySQL.delete_client)
+        '''
+        logging.info('Запуск функции (delete_client) '
+                     'удаления информации: %s', params)
+        client_id = (params['client_id'] if params.get('client_id')
+                     else await self.find_client(params, _id_only=True))
+        if not client_id:
+            return
+        async with self.pool.acquire() as connection:
+            deleted = await connection.fetchval(STATEMENTS['pysql_delete_client'], client_id)
+        self._invalidate(('client_id', client_id))
+        if deleted:
+            logging.info('SUCCESS: Информация о клиенте (%s) '
+                         'удалена из таблицы "client"', client_id)
+        else:
+            logging.info('Информация о клиенте отсутствует')
+
+    async def find_client(self, params:dict, _id_only=False) -> dict:
+        '''
+        Функция поиска данных о клиенте по введенным параметрам (см. PySQL.find_client)
+        '''
+        logging.info('Запуск функции (find_client) '
+                     'поиска информации: %s', params)
+        if _id_only and params.get('client_id'):
+            return params['client_id']
+        if (key := lookup_key(params)) is None:
+            logging.warning('Недостаточно данных для поиска информации о клиенте в базе данных. '
+                            'Дальнейший поиск невозможен')
+            return
+        if self.cache is not None and (result := self.cache.get(key)):
+            logging.info('SUCCESS: Информация о клиенте (из кэша): %s', result)
+            return result['client_id'] if _id_only else result
+        kind, *values = key
+        statement = 'pysql_find_by_id' if kind == 'client_id' else f'pysql_find_by_{kind}'
+        async with self.pool.acquire() as connection:
+            info = await connection.fetch(STATEMENTS[statement], *values)
+        if not info:
+            logging.warning('По ключу поиска %s клиент не найден', key)
+            return
+        tmp, *_ = info
+        result = self._record(*tmp[:4], [row[4] for row in info if row[4] and row[0] == tmp[0]])
+        if self.cache is not None:
+            self.cache.put(result)
+        if _id_only:
+            return tmp[0]
+        logging.info('SUCCESS: Информация о клиенте: %s', result)
+        return result
+
+    async def find_clients(self, params_list:list) -> list:
+        '''
+        Функция множественного поиска данных о клиентах (см. PySQL.find_clients)
+        Группы ключей поиска разных типов запрашиваются параллельно
+        на разных соединениях пула
+        '''
+        logging.info('Запуск функции (find_clients) '
+                     'поиска информации о клиентах: %s шт.', len(params_list))
+        results = [None] * len(params_list)
+        groups = {}
+        for position, params in enumerate(params_list):
+            if (key := lookup_key(params)) is None:
+                logging.warning('Недостаточно данных для поиска информации о клиенте: %s', params)
+                continue
+            if self.cache is not None and (result := self.cache.get(key)):
+                results[position] = result
+                continue
+            groups.setdefault(key[0], {}).setdefault(key[1:], []).append(position)
+
+        async def fetch(kind, lookups):
+            async with self.pool.acquire() as connection:
+                rows = await connection.fetch(STATEMENTS[f'pysql_find_many_by_{kind}'],
+                                              *map(list, zip(*lookups)))
+            width = len(next(iter(lookups)))
+            for row in rows:
+                result = self._record(*row[width:])
+                if self.cache is not None:
+                    self.cache.put(result)
+                for position in lookups.get(tuple(row[:width]), ()):
+                    results[position] = copy_client(result)
+
+        await asyncio.gather(*(fetch(kind, lookups) for kind, lookups in groups.items()))
+        logging.info('SUCCESS: Найдено клиентов: '
+                     '%s из %s', sum(result is not None for result in results), len(results))
+        return results
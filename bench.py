@@ -0,0 +1,313 @@
+'''
+Нагрузочное тестирование класса PySQL на синтетических данных rand_info
+База данных заполняется clients клиентами по phones номеров телефона у каждого,
+после чего смешанная нагрузка из вызовов всех методов PySQL выполняется
+в один и в несколько потоков. Результат (пропускная способность и задержки
+p50/p95/p99 по каждой операции) выводится в формате JSON
+Пример запуска:
+    python bench.py --clients 100000 --phones 2 --operations 20000 --threads 1 8 \
+                    --output bench.json --baseline previous.json
+ВНИМАНИЕ: при заполнении (--seed) таблицы базы данных пересоздаются
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from random import choice
+from random import choices
+from random import sample
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import threading
+import time
+
+from main import PySQL
+from main import rand_info
+
+# Операции и их веса в профилях нагрузки
+MIXES = {
+    'read': {'find_client': 65, 'find_clients': 15, 'iter_clients': 5, 'search_clients': 5,
+             'add_phone': 5, 'change_client': 5},
+    'write': {'add_client': 25, 'add_phone': 20, 'change_client': 20, 'delete_phone': 15,
+              'delete_client': 10, 'import_clients': 5, 'find_client': 5},
+    'mixed': {'find_client': 35, 'find_clients': 5, 'iter_clients': 5, 'search_clients': 5,
+              'add_client': 10, 'add_phone': 10, 'change_client': 10, 'delete_phone': 8,
+              'delete_client': 7, 'import_clients': 5},
+}
+
+
+class Workload:
+    '''
+    Генератор операций над базой данных на основе rand_info
+    sample - выборка существующих клиентов для операций чтения и изменения
+    Клиенты и номера, добавленные в ходе теста, запоминаются и используются
+    операциями удаления, поэтому исходная выборка не разрушается
+    '''
+    def __init__(self, pysql:PySQL, sample_clients:list, batch=100):
+        self.pysql = pysql
+        self.sample = sample_clients
+        self.batch = batch
+        self._ids = count()
+        self._created = deque()
+        self._phones = deque()
+        self._run = f'{int(time.time()) % 100000}'
+
+    def _client(self) -> dict:
+        '''
+        Функция генерации нового клиента с уникальным адресом почты
+        '''
+        return {'name': rand_info('name'),
+                'surname': rand_info('surname'),
+                'mail': f'b{self._run}_{next(self._ids)}_{rand_info('mail')}',
+                'number': [rand_info('number')]}
+
+    def _lookup(self) -> dict:
+        '''
+        Функция генерации словаря params для поиска случайного клиента выборки
+        '''
+        client = choice(self.sample)
+        match choice(('client_id', 'mail', 'number', 'name')):
+            case 'client_id':
+                return {'client_id': client['client_id']}
+            case 'mail':
+                return {'mail': client['mail']}
+            case 'number' if client['number']:
+                return {'number': client['number'][0]}
+            case _:
+                return {'name': client['name'], 'surname': client['surname']}
+
+    def find_client(self):
+        self.pysql.find_client(self._lookup())
+
+    def find_clients(self):
+        self.pysql.find_clients([self._lookup() for _ in range(self.batch)])
+
+    def iter_clients(self):
+        ids = [client['client_id'] for client in sample(self.sample, min(self.batch,
+                                                                         len(self.sample)))]
+        for _ in self.pysql.iter_clients({'client_id': ids}):
+            pass
+
+    def search_clients(self):
+        self.pysql.search_clients(choice(self.sample)['surname'][:4], limit=self.batch,
+                                  prefix=True)
+
+    def add_client(self):
+        params = self._client()
+        self.pysql.add_client(params)
+        self._created.append(params['mail'])
+
+    def import_clients(self):
+        self.pysql.import_clients([self._client() for _ in range(self.batch)])
+
+    def add_phone(self):
+        number = rand_info('number')
+        self.pysql.add_phone({'client_id': choice(self.sample)['client_id'],
+                              'new_number': number})
+        self._phones.append(number)
+
+    def change_client(self):
+        client = choice(self.sample)
+        self.pysql.change_client({'client_id': client['client_id'],
+                                  'new_name': rand_info('name'),
+                                  'new_surname': rand_info('surname')})
+
+    def delete_phone(self):
+        try:
+            number = self._phones.popleft()
+        except IndexError:
+            return self.add_phone()
+        self.pysql.delete_phone({'number': number})
+
+    def delete_client(self):
+        try:
+            mail = self._created.popleft()
+        except IndexError:
+            return self.add_client()
+        self.pysql.delete_client({'mail': mail})
+
+
+def seed(pysql:PySQL, clients:int, phones:int) -> dict:
+    '''
+    Функция пересоздания таблиц и заполнения базы данных синтетическими клиентами
+    '''
+    pysql.delete_table()
+    pysql.create_table()
+    records = ({'name': rand_info('name'),
+                'surname': rand_info('surname'),
+                'mail': f's{i}_{rand_info('mail')}',
+                'number': [rand_info('number') for _ in range(phones)]}
+               for i in range(clients))
+    start = time.perf_counter()
+    report = pysql.import_clients(records, batch_size=5000)
+    seconds = time.perf_counter() - start
+    return {'seconds': round(seconds, 3),
+            'clients': report['clients'],
+            'phones': report['phones'],
+            'rejected': len(report['rejected']),
+            'clients_per_second': round(report['clients'] / seconds, 1) if seconds else None}
+
+
+def summarize(latencies:list) -> dict:
+    '''
+    Функция расчета статистики задержек (мс) операции
+    '''
+    latencies = sorted(latencies)
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    return {'count': len(latencies),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'p50_ms': round(p50 * 1000, 3),
+            'p95_ms': round(p95 * 1000, 3),
+            'p99_ms': round(p99 * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3)}
+
+
+def run(workload:Workload, mix:dict, operations:int, threads:int) -> dict:
+    '''
+    Функция выполнения operations операций профиля mix в threads потоков
+    '''
+    names, weights = zip(*mix.items())
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+
+    def worker(share):
+        local = {name: [] for name in names}
+        failed = dict.fromkeys(names, 0)
+        for name in choices(names, weights, k=share):
+            start = time.perf_counter()
+            try:
+                getattr(workload, name)()
+            except Exception as error:
+                failed[name] += 1
+                logging.warning('Ошибка операции %s: %s', name, error)
+                continue
+            local[name].append(time.perf_counter() - start)
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+                errors[name] += failed[name]
+
+    shares = [operations // threads + (i < operations % threads) for i in range(threads)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(worker, shares))
+    seconds = time.perf_counter() - start
+    done = sum(map(len, latencies.values()))
+    return {'threads': threads,
+            'seconds': round(seconds, 3),
+            'throughput': round(done / seconds, 1) if seconds else None,
+            'errors': sum(errors.values()),
+            'operations': {name: {**summarize(values), 'errors': errors[name]}
+                           for name, values in latencies.items() if values}}
+
+
+def compare(result:dict, baseline:dict, tolerance:float) -> list:
+    '''
+    Функция сравнения результата с предыдущим (baseline)
+    Возвращает список регрессий: падение пропускной способности
+    или рост задержки p95 больше, чем на долю tolerance
+    '''
+    regressions = []
+    previous = {run['threads']: run for run in baseline.get('runs', ())}
+    for current in result['runs']:
+        if (old := previous.get(current['threads'])) is None:
+            continue
+        if current['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append(f'threads={current['threads']}: throughput '
+                               f'{old['throughput']} -> {current['throughput']}')
+        for name, stats in current['operations'].items():
+            if (old_stats := old['operations'].get(name)) is None:
+                continue
+            if stats['p95_ms'] > old_stats['p95_ms'] * (1 + tolerance):
+                regressions.append(f'threads={current['threads']}: {name} p95 '
+                                   f'{old_stats['p95_ms']} -> {stats['p95_ms']} ms')
+    return regressions
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование PySQL')
+    parser.add_argument('--database', default='pypost')
+    parser.add_argument('--user', default=config.database_name)
+    parser.add_argument('--password', default=config.database_password)
+    parser.add_argument('--clients', type=int, default=10000,
+                        help='количество клиентов при заполнении базы данных')
+    parser.add_argument('--phones', type=int, default=2,
+                        help='количество номеров телефона у каждого клиента')
+    parser.add_argument('--no-seed', dest='seed', action='store_false',
+                        help='не пересоздавать таблицы, использовать имеющиеся данные')
+    parser.add_argument('--operations', type=int, default=5000,
+                        help='количество операций в каждом прогоне')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4],
+                        help='количество потоков (по прогону на каждое значение)')
+    parser.add_argument('--mix', choices=MIXES, default='mixed', help='профиль нагрузки')
+    parser.add_argument('--batch', type=int, default=100,
+                        help='размер пачки для find_clients, iter_clients, import_clients')
+    parser.add_argument('--sample', type=int, default=10000,
+                        help='размер выборки клиентов для операций чтения')
+    parser.add_argument('--cache', type=int, default=0, help='размер кэша find_client')
+    parser.add_argument('--records', action='store_true',
+                        help='получать результаты чтения в виде записей Client')
+    parser.add_argument('--output', help='файл для записи результата (по-умолчанию - stdout)')
+    parser.add_argument('--baseline', help='файл результата предыдущего запуска для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='допустимое ухудшение относительно baseline (доля)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(message)s')
+    pysql = PySQL(args.database, args.user, args.password,
+                  maxconn=max(args.threads) + 1, cache_size=args.cache, records=args.records)
+    result = {'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'mix': args.mix,
+                       'operations': args.operations,
+                       'clients': args.clients,
+                       'phones': args.phones,
+                       'cache': args.cache,
+                       'records': args.records}}
+    if args.seed:
+        result['seed'] = seed(pysql, args.clients, args.phones)
+    start = time.perf_counter()
+    sample_clients = []
+    for client in pysql.iter_clients():
+        sample_clients.append(client)
+        if len(sample_clients) >= args.sample:
+            break
+    result['iter_clients'] = {'clients': len(sample_clients),
+                              'seconds': round(time.perf_counter() - start, 3)}
+    if not sample_clients:
+        sys.exit('В базе данных нет клиентов для тестирования, запустите заполнение (--seed)')
+    workload = Workload(pysql, sample_clients, args.batch)
+    result['runs'] = [run(workload, MIXES[args.mix], args.operations, threads)
+                      for threads in args.threads]
+    result['pool'] = pysql.pool_stats()
+    result['cache'] = pysql.cache_stats()
+    pysql.close()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'РЕГРЕССИЯ: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
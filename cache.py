@@ -0,0 +1,131 @@
+'''
+Кэш результатов поиска информации о клиентах
+'''
+from collections import OrderedDict
+import threading
+import time
+
+from records import copy_client
+
+
+def lookup_key(params:dict):
+    '''
+    Функция получения ключа поиска клиента по словарю params (в порядке приоритета):
+        ('client_id', int), ('mail', str), ('number', str), ('name', str, str)
+    Возвращает None, если идентификационной информации недостаточно
+    '''
+    if client_id := params.get('client_id'):
+        return 'client_id', client_id
+    if mail := params.get('mail'):
+        return 'mail', mail
+    if number := params.get('number'):
+        return 'number', str(number[0] if isinstance(number, list) else number)
+    if params.get('name') and params.get('surname'):
+        return 'name', params['name'], params['surname']
+
+
+class ClientCache:
+    '''
+    Потокобезопасный кэш результатов find_client с вытеснением давно не использованных
+    записей (LRU) и ограниченным временем жизни записей (TTL)
+        maxsize - максимальное количество клиентов в кэше
+        ttl - время жизни записи (сек)
+    Записи хранятся по идентификатору клиента; ключи поиска вида
+        ('client_id', int), ('mail', str), ('number', str), ('name', str, str)
+    разрешаются в идентификатор клиента через вторичный индекс, поэтому
+    поиск по номеру телефона или адресу почты находит ту же запись кэша
+    '''
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('hits', 'misses', 'evictions', 'invalidations'), 0)
+
+    @staticmethod
+    def _keys(result:dict) -> list:
+        '''
+        Функция получения ключей вторичного индекса для записи о клиенте
+        '''
+        return [('mail', result['mail']),
+                ('name', result['name'], result['surname']),
+                *(('number', number) for number in result['number'])]
+
+    def _resolve(self, key:tuple):
+        '''
+        Функция получения идентификатора клиента по ключу поиска
+        '''
+        return key[1] if key[0] == 'client_id' else self._index.get(key)
+
+    def _remove(self, client_id):
+        '''
+        Функция удаления записи о клиенте и ее ключей вторичного индекса
+        Вызывается с захваченной блокировкой кэша
+        '''
+        _, _, keys = self._entries.pop(client_id)
+        for key in keys:
+            if self._index.get(key) == client_id:
+                del self._index[key]
+
+    def get(self, key:tuple):
+        '''
+        Функция получения копии записи о клиенте по ключу поиска
+        Возвращает None, если запись отсутствует или устарела
+        '''
+        with self._lock:
+            client_id = self._resolve(key)
+            if (entry := self._entries.get(client_id)) is None:
+                self._stats['misses'] += 1
+                return
+            if entry[0] < time.monotonic():
+                self._remove(client_id)
+                self._stats['misses'] += 1
+                return
+            self._entries.move_to_end(client_id)
+            self._stats['hits'] += 1
+            result = entry[1]
+        return copy_client(result)
+
+    def put(self, result:dict):
+        '''
+        Функция добавления (обновления) записи о клиенте (словаря или записи Client)
+        '''
+        result = copy_client(result)
+        client_id = result['client_id']
+        keys = self._keys(result)
+        with self._lock:
+            if client_id in self._entries:
+                self._remove(client_id)
+            self._entries[client_id] = (time.monotonic() + self.ttl, result, keys)
+            for key in keys:
+                self._index[key] = client_id
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def invalidate(self, *keys):
+        '''
+        Функция удаления записей о клиентах, найденных по ключам поиска
+        '''
+        with self._lock:
+            for key in keys:
+                if (client_id := self._resolve(key)) in self._entries:
+                    self._remove(client_id)
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        '''
+        Функция очистки кэша
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self) -> dict:
+        '''
+        Функция получения статистики кэша
+        '''
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize,
+                    'ttl': self.ttl, **self._stats}
@@ -0,0 +1,235 @@
+'''
+Инструментирование работы с базой данных: счетчики, гистограммы задержек,
+журнал медленных запросов и выборочный EXPLAIN ANALYZE
+'''
+from collections import deque
+import functools
+import inspect
+import logging
+import threading
+import time
+
+# Верхние границы (сек) интервалов гистограмм задержек
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HELP = {
+    'pysql_call_seconds': 'Время выполнения методов PySQL',
+    'pysql_call_errors_total': 'Количество методов PySQL, завершившихся исключением',
+    'pysql_acquire_seconds': 'Время получения соединения из пула',
+    'pysql_query_seconds': 'Время выполнения запросов',
+    'pysql_query_rows_total': 'Количество строк, возвращенных или измененных запросами',
+    'pysql_commit_seconds': 'Время фиксации транзакций',
+    'pysql_slow_queries_total': 'Количество медленных запросов',
+}
+
+
+def statement_name(query:str) -> str:
+    '''
+    Функция получения метки запроса для метрик:
+    имя подготовленного запроса для EXECUTE, иначе - первое слово запроса
+    '''
+    words = query.split(None, 2)
+    if not words:
+        return ''
+    if words[0].upper() == 'EXECUTE' and len(words) > 1:
+        return words[1].split('(', 1)[0]
+    return words[0].upper().rstrip(';')
+
+
+def instrumented(method):
+    '''
+    Декоратор замера времени выполнения метода PySQL
+    Для функций-генераторов замеряется время до полного исчерпания (или закрытия)
+    При отключенном инструментировании (instrumentation = None) метод вызывается напрямую
+    '''
+    name = method.__name__
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if (instrumentation := self.instrumentation) is None:
+                return (yield from method(self, *args, **kwargs))
+            start, error = time.perf_counter(), False
+            try:
+                return (yield from method(self, *args, **kwargs))
+            except Exception:
+                error = True
+                raise
+            finally:
+                instrumentation.on_call(name, time.perf_counter() - start, error)
+        return wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if (instrumentation := self.instrumentation) is None:
+            return method(self, *args, **kwargs)
+        start, error = time.perf_counter(), True
+        try:
+            result = method(self, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            instrumentation.on_call(name, time.perf_counter() - start, error)
+    return wrapper
+
+
+class Instrumentation:
+    '''
+    Потокобезопасный сборщик метрик работы PySQL
+        slow_query - порог (сек), начиная с которого запрос попадает в журнал
+                     медленных запросов (None - журнал отключен)
+        explain_rate - доля запросов поиска клиента (_find_client_w_*), для которых
+                       дополнительно выполняется EXPLAIN ANALYZE (0 - отключено)
+        callback - функция callback(event, **fields), вызываемая для каждого события:
+                   'call', 'acquire', 'query', 'rows', 'commit', 'slow_query', 'explain'
+    Метрики доступны методом snapshot (словарь) и render_prometheus
+    (текстовый формат Prometheus), последние планы EXPLAIN - в атрибуте plans
+    '''
+    def __init__(self, slow_query=None, explain_rate=0.0, callback=None):
+        self.slow_query = slow_query
+        self.explain_rate = explain_rate
+        self.callback = callback
+        self.plans = deque(maxlen=20)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, metric:str, value=1, **labels):
+        '''
+        Функция увеличения счетчика
+        '''
+        key = metric, tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric:str, seconds:float, **labels):
+        '''
+        Функция добавления значения в гистограмму
+        '''
+        key = metric, tuple(sorted(labels.items()))
+        with self._lock:
+            if (histogram := self._histograms.get(key)) is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            for position, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[position] += 1
+                    break
+            else:
+                histogram[len(BUCKETS)] += 1
+            histogram[-1] += seconds
+
+    def _emit(self, event:str, **fields):
+        '''
+        Функция передачи события во внешний обработчик
+        '''
+        if self.callback is not None:
+            try:
+                self.callback(event, **fields)
+            except Exception as error:
+                logging.warning('Ошибка обработчика метрик (%s) - %s', event, error)
+
+    def on_call(self, method:str, seconds:float, error=False):
+        '''
+        Функция учета выполнения метода PySQL
+        '''
+        self.observe('pysql_call_seconds', seconds, method=method)
+        if error:
+            self.increment('pysql_call_errors_total', method=method)
+        self._emit('call', method=method, seconds=seconds, error=error)
+
+    def on_acquire(self, seconds:float):
+        '''
+        Функция учета получения соединения из пула
+        '''
+        self.observe('pysql_acquire_seconds', seconds)
+        self._emit('acquire', seconds=seconds)
+
+    def on_query(self, query:str, seconds:float, rows:int):
+        '''
+        Функция учета выполнения запроса (и записи в журнал медленных запросов)
+        '''
+        statement = statement_name(query)
+        self.observe('pysql_query_seconds', seconds, statement=statement)
+        if rows > 0:
+            self.increment('pysql_query_rows_total', rows, statement=statement)
+        self._emit('query', statement=statement, seconds=seconds, rows=rows)
+        if self.slow_query is not None and seconds >= self.slow_query:
+            self.increment('pysql_slow_queries_total', statement=statement)
+            logging.warning('Медленный запрос (%.3f сек): %s',
+                            seconds, ' '.join(query.split())[:500])
+            self._emit('slow_query', statement=statement, seconds=seconds, query=query)
+
+    def on_rows(self, query:str, rows:int):
+        '''
+        Функция учета строк, прочитанных именованным (серверным) курсором
+        '''
+        statement = statement_name(query)
+        self.increment('pysql_query_rows_total', rows, statement=statement)
+        self._emit('rows', statement=statement, rows=rows)
+
+    def on_commit(self, seconds:float):
+        '''
+        Функция учета фиксации транзакции
+        '''
+        self.observe('pysql_commit_seconds', seconds)
+        self._emit('commit', seconds=seconds)
+
+    def on_explain(self, query:str, plan:str):
+        '''
+        Функция сохранения плана выполнения запроса (EXPLAIN ANALYZE)
+        '''
+        self.plans.append((statement_name(query), plan))
+        logging.info('План запроса %s:\n%s', statement_name(query), plan)
+        self._emit('explain', statement=statement_name(query), plan=plan)
+
+    def snapshot(self) -> dict:
+        '''
+        Функция получения текущих значений метрик
+            {'counters': {(metric, labels): value},
+             'histograms': {(metric, labels): {'count': int, 'sum': float, 'buckets': {le: int}}}}
+        Значения интервалов гистограмм накопительные, как в формате Prometheus
+        '''
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        result = {'counters': counters, 'histograms': {}}
+        for key, histogram in histograms.items():
+            buckets, total = {}, 0
+            for bound, value in zip((*BUCKETS, float('inf')), histogram):
+                total += value
+                buckets[bound] = total
+            result['histograms'][key] = {'count': total, 'sum': histogram[-1],
+                                         'buckets': buckets}
+        return result
+
+    def render_prometheus(self, gauges=None) -> str:
+        '''
+        Функция выгрузки метрик в текстовом формате Prometheus
+        Параметр gauges принимает словарь {имя: значение} дополнительных
+        мгновенных показателей (например, статистики пула соединений)
+        '''
+        def labels(pairs, extra=()):
+            pairs = (*pairs, *extra)
+            return ('{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+                    if pairs else '')
+
+        snapshot = self.snapshot()
+        lines, described = [], set()
+        for (metric, pairs), value in sorted(snapshot['counters'].items()):
+            if metric not in described:
+                described.add(metric)
+                lines += [f'# HELP {metric} {_HELP.get(metric, metric)}',
+                          f'# TYPE {metric} counter']
+            lines.append(f'{metric}{labels(pairs)} {value}')
+        for (metric, pairs), histogram in sorted(snapshot['histograms'].items()):
+            if metric not in described:
+                described.add(metric)
+                lines += [f'# HELP {metric} {_HELP.get(metric, metric)}',
+                          f'# TYPE {metric} histogram']
+            for bound, value in histogram['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{labels(pairs, (('le', le),))} {value}')
+            lines.append(f'{metric}_sum{labels(pairs)} {histogram['sum']}')
+            lines.append(f'{metric}_count{labels(pairs)} {histogram['count']}')
+        for name, value in (gauges or {}).items():
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
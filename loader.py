@@ -0,0 +1,260 @@
+'''
+Параллельная загрузка информации о клиентах несколькими процессами
+Входные данные (файл CSV/JSONL или итерируемый объект со словарями params,
+см. PySQL.import_clients) читаются и проверяются в основном процессе:
+повторяющиеся адреса почты и номера телефона, а также уже имеющиеся в базе данных,
+отклоняются до отправки на сервер. Проверенные пачки записей распределяются
+между процессами пула, каждый из которых загружает их через собственное соединение
+Пример запуска:
+    python loader.py clients.csv --workers 8 --batch 5000 --output report.json
+'''
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from itertools import islice
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+
+from main import PySQL
+from main import _check_clients
+from main import _read_clients
+from main import _rejected
+from queries import LOADER_ALL_MAILS
+from queries import LOADER_ALL_NUMBERS
+from queries import LOADER_COUNTS
+from queries import LOADER_EXISTING_MAILS
+from queries import LOADER_EXISTING_NUMBERS
+
+# Соединение процесса пула с базой данных (создается в _init_worker)
+_worker = None
+
+
+class BloomFilter:
+    '''
+    Компактный вероятностный фильтр множества строк
+    Проверка "value in filter" не дает ложноотрицательных ответов, а ложноположительные
+    возникают с вероятностью не больше error_rate, пока количество добавленных
+    значений не превышает capacity
+    '''
+    def __init__(self, capacity:int, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value:str):
+        '''
+        Функция вычисления номеров битов значения (двойное хэширование)
+        '''
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value:str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value:str) -> bool:
+        return all(self.bits[position >> 3] & 1 << (position & 7)
+                   for position in self._positions(value))
+
+    def __len__(self):
+        return self.count
+
+
+def existing_values(pysql:PySQL, error_rate=0.001) -> tuple:
+    '''
+    Функция построения фильтров Блума по адресам почты и номерам телефона,
+    уже имеющимся в базе данных
+    Возвращает кортеж (фильтр адресов почты, фильтр номеров телефона)
+    '''
+    with pysql as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(LOADER_COUNTS)
+            clients, phones = cursor.fetchone()
+        filters = BloomFilter(clients, error_rate), BloomFilter(phones, error_rate)
+        for bloom, query in zip(filters, (LOADER_ALL_MAILS, LOADER_ALL_NUMBERS)):
+            with connection.cursor('pysql_loader_scan') as cursor:
+                cursor.itersize = 10000
+                cursor.execute(query)
+                for value, in cursor:
+                    bloom.add(value)
+    logging.info('Прочитано из базы данных адресов почты - %s, номеров телефона - %s',
+                 len(filters[0]), len(filters[1]))
+    return filters
+
+
+def _confirm(pysql:PySQL, mails:list, numbers:list) -> tuple:
+    '''
+    Функция проверки по базе данных значений, найденных фильтрами Блума
+    Возвращает кортеж множеств действительно существующих адресов почты и номеров
+    '''
+    taken_mails, taken_numbers = set(), set()
+    if not mails and not numbers:
+        return taken_mails, taken_numbers
+    with pysql as connection:
+        with connection.cursor() as cursor:
+            for values, query, taken in ((mails, LOADER_EXISTING_MAILS, taken_mails),
+                                         (numbers, LOADER_EXISTING_NUMBERS, taken_numbers)):
+                if values:
+                    cursor.execute(query, (values,))
+                    taken.update(value for value, in cursor)
+        connection.rollback()
+    return taken_mails, taken_numbers
+
+
+def precheck(pysql:PySQL, batch:list, existing:tuple, seen:tuple, rejected:list) -> list:
+    '''
+    Функция предварительной проверки пачки записей (row, params)
+    Отклоняются ошибочные записи и записи с адресом почты, уже имеющимся в базе данных
+    или встретившимся ранее во входных данных; такие номера телефона исключаются из записи
+    existing - фильтры Блума содержимого базы данных (см. existing_values),
+    seen - множества уже принятых адресов почты и номеров
+    Возвращает список принятых записей (row, params)
+    '''
+    mail_filter, number_filter = existing
+    seen_mails, seen_numbers = seen
+    candidates = []
+    for (row, params), reason in zip(batch, _check_clients([params for _, params in batch])):
+        if isinstance(reason, str):
+            rejected.append(_rejected(row, params, reason))
+        else:
+            candidates.append((row, params, reason[2], reason[3]))
+    taken_mails, taken_numbers = _confirm(
+        pysql,
+        [mail for _, _, mail, _ in candidates if mail in mail_filter],
+        [number for *_, numbers in candidates for number in numbers if number in number_filter])
+    shard = []
+    for row, params, mail, numbers in candidates:
+        if mail in taken_mails or mail in seen_mails:
+            rejected.append({'row': row, 'params': params,
+                             'reason': f'Адрес почты {mail} уже существует'})
+            continue
+        seen_mails.add(mail)
+        clean = []
+        for number in numbers:
+            if number in taken_numbers or number in seen_numbers:
+                rejected.append({'row': row, 'params': params,
+                                 'reason': f'Номер {number} уже существует'})
+            else:
+                seen_numbers.add(number)
+                clean.append(number)
+        shard.append((row, {**params, 'number': clean}))
+    return shard
+
+
+def _init_worker(database:str, user:str, password:str, connect_kwargs:dict):
+    '''
+    Функция инициализации процесса пула: одно соединение с базой данных на процесс
+    '''
+    global _worker
+    _worker = PySQL(database, user, password, minconn=1, maxconn=1, **connect_kwargs)
+
+
+def _load_shard(shard:list) -> dict:
+    '''
+    Функция загрузки пачки проверенных записей (row, params) в процессе пула
+    Возвращает отчет import_clients с номерами строк входных данных
+    '''
+    rows = [row for row, _ in shard]
+    report = _worker.import_clients([params for _, params in shard], batch_size=len(shard))
+    for item in report['rejected']:
+        item['row'] = rows[item['row'] - 1]
+    return report
+
+
+def load_clients(source, database:str, user:str, password:str,
+                 workers=None, batch_size=1000, error_rate=0.001, **connect_kwargs) -> dict:
+    '''
+    Функция параллельной загрузки информации о клиентах в workers процессов
+    (по-умолчанию - по количеству ядер процессора)
+    Записи проверяются и распределяются между процессами пачками по batch_size,
+    одновременно в очереди находится не больше двух пачек на процесс
+    Уникальность адресов почты и номеров проверяется до загрузки: по входным данным -
+    точно (множества), по содержимому базы данных - фильтрами Блума с допустимой
+    долей ложных совпадений error_rate, совпадения подтверждаются запросом
+    Остальные именованные аргументы (host, port и т.д.) передаются в PySQL
+    Возвращает отчет в формате import_clients:
+        {'clients': int, 'phones': int,
+         'rejected': [{'row': int, 'params': dict, 'reason': str}, ...]}
+    '''
+    workers = workers or os.cpu_count() or 1
+    logging.info('Запуск параллельной загрузки информации о клиентах: %s (процессов - %s)',
+                 source, workers)
+    report = {'clients': 0, 'phones': 0, 'rejected': []}
+    seen = set(), set()
+    rows = enumerate(_read_clients(source), 1)
+
+    def merge(futures):
+        for future in futures:
+            result = future.result()
+            report['clients'] += result['clients']
+            report['phones'] += result['phones']
+            report['rejected'].extend(result['rejected'])
+
+    pysql = PySQL(database, user, password, minconn=1, maxconn=1, **connect_kwargs)
+    try:
+        existing = existing_values(pysql, error_rate)
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(database, user, password, connect_kwargs)) as executor:
+            pending = set()
+            while batch := list(islice(rows, batch_size)):
+                if shard := precheck(pysql, batch, existing, seen, report['rejected']):
+                    pending.add(executor.submit(_load_shard, shard))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    merge(done)
+            merge(pending)
+    finally:
+        pysql.close()
+    report['rejected'].sort(key=lambda item: item['row'])
+    if report['rejected']:
+        logging.warning('Отклонено записей при загрузке: %s', len(report['rejected']))
+    logging.info('SUCCESS: Загружено клиентов - %s, '
+                 'номеров телефона - %s', report['clients'], report['phones'])
+    return report
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description='Параллельная загрузка клиентов в базу данных')
+    parser.add_argument('source', help='файл CSV или JSONL с информацией о клиентах')
+    parser.add_argument('--database', default='pypost')
+    parser.add_argument('--user', default=config.database_name)
+    parser.add_argument('--password', default=config.database_password)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='количество процессов загрузки')
+    parser.add_argument('--batch', type=int, default=1000, help='размер пачки записей')
+    parser.add_argument('--error-rate', type=float, default=0.001,
+                        help='доля ложных совпадений фильтра Блума')
+    parser.add_argument('--output', help='файл для записи отчета (по-умолчанию - stdout)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(message)s')
+    connect_kwargs = {key: value for key in ('host', 'port')
+                      if (value := getattr(args, key)) is not None}
+    start = time.perf_counter()
+    report = load_clients(args.source, args.database, args.user, args.password,
+                          args.workers, args.batch, args.error_rate, **connect_kwargs)
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,484 @@
+from collections import deque
+from contextlib import contextmanager
+from contextlib import nullcontext
+from itertools import chain
+from itertools import count
+from itertools import islice
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
 from random import choice
 from random import randint
+from random import random
+import atexit
+import csv
+import io
+import json
 import logging
-import sys
+import os
+import queue
+import re
+import threading
+import time
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError
+
+from cache import ClientCache
+from cache import lookup_key
+from instrumentation import instrumented
+from migrations import MIGRATION_LOCK
+from migrations import MIGRATIONS
+from migrations import SCHEMA_VERSION_TABLE
+from queries import ITER_CLIENTS
+from queries import REPLICA_LAG
+from queries import SEARCH_BRANCHES
+from queries import SEARCH_CLIENTS
+from queries import STATEMENTS
+from queries import SYNC_COPY_CLIENTS
+from queries import SYNC_COPY_PHONES
+from queries import SYNC_STATEMENTS
+from queries import SYNC_TABLES
+from records import FIELDS
+from records import Client
+from records import Phone
+from records import copy_client
+from validation import validate_mails
+from validation import validate_numbers
+
+# Счетчик имен именованных курсоров: имя курсора уникально в пределах соединения
+_ITER_IDS = count()
+
+class ConnectionPool:
+    '''
+    Потокобезопасный пул соединений с базой данных PostgreSQL
+        minconn - количество соединений, открываемых при создании пула (и ниже
+                  которого пул не опускается при закрытии простаивающих соединений)
+        maxconn - максимальное количество одновременно открытых соединений
+        max_idle - время простоя (сек), после которого лишнее соединение закрывается
+        check_after - время простоя (сек), после которого соединение перед выдачей
+                      проверяется запросом SELECT 1
+        timeout - время ожидания (сек) свободного соединения при исчерпании пула
+    Остальные именованные аргументы передаются в psycopg2.connect
+    '''
+    def __init__(self, minconn=1, maxconn=10, max_idle=300, check_after=30, timeout=30,
+                 **connect_kwargs):
+        if not 0 <= minconn <= maxconn or maxconn < 1:
+            raise PoolError(f'Некорректные границы пула: minconn={minconn}, maxconn={maxconn}')
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        self._connect_kwargs = connect_kwargs
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        self._stats = dict.fromkeys(('created', 'closed', 'borrowed', 'returned',
+                                     'waits', 'failed_checks', 'recycled'), 0)
+        for _ in range(minconn):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        '''
+        Функция создания нового соединения пула
+        '''
+        connection = psycopg2.connect(**self._connect_kwargs)
+        with self._lock:
+            self._stats['created'] += 1
+        return connection
+
+    def _check(self, connection, last_used) -> bool:
+        '''
+        Функция проверки работоспособности соединения перед выдачей
+        '''
+        if connection.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _recycle(self):
+        '''
+        Функция закрытия соединений, простаивающих дольше max_idle
+        Вызывается с захваченной блокировкой пула
+        '''
+        deadline = time.monotonic() - self.max_idle
+        while self._idle and self._idle[0][1] < deadline and self._size > self.minconn:
+            connection, _ = self._idle.popleft()
+            connection.close()
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._stats['recycled'] += 1
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        '''
+        Функция получения соединения из пула
+        Если свободных соединений нет и пул заполнен - ожидает возврата соединения
+        не дольше timeout секунд, после чего вызывает PoolError
+        '''
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        raise PoolError('Пул соединений закрыт')
+                    self._recycle()
+                    if self._idle:
+                        connection, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        connection = last_used = None
+                        break
+                    if (remaining := deadline - time.monotonic()) <= 0:
+                        raise PoolError(f'Нет свободных соединений в течение {self.timeout} сек')
+                    self._stats['waits'] += 1
+                    self._lock.wait(remaining)
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except BaseException:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._check(connection, last_used):
+                logging.warning('Соединение пула не прошло проверку и будет закрыто')
+                with self._lock:
+                    self._stats['failed_checks'] += 1
+                self._discard(connection)
+                continue
+            with self._lock:
+                self._stats['borrowed'] += 1
+            return connection
+
+    def putconn(self, connection, discard=False):
+        '''
+        Функция возврата соединения в пул
+        Незавершенная транзакция откатывается, неисправное соединение закрывается
+        '''
+        if not discard and not connection.closed:
+            if (connection.get_transaction_status() !=
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or connection.closed:
+            self._discard(connection)
+            return
+        with self._lock:
+            self._stats['returned'] += 1
+            if self._closed:
+                self._size -= 1
+                self._stats['closed'] += 1
+                connection.close()
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._lock.notify()
+
+    def _discard(self, connection):
+        '''
+        Функция закрытия соединения с освобождением места в пуле
+        '''
+        if not connection.closed:
+            connection.close()
+        with self._lock:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._lock.notify()
+
+    def closeall(self):
+        '''
+        Функция закрытия пула и всех свободных соединений
+        Выданные соединения закрываются при возврате в пул
+        '''
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.popleft()
+                connection.close()
+                self._size -= 1
+                self._stats['closed'] += 1
+            self._lock.notify_all()
+
+    def stats(self) -> dict:
+        '''
+        Функция получения статистики пула
+        '''
+        with self._lock:
+            return {'size': self._size,
+                    'idle': len(self._idle),
+                    'in_use': self._size - len(self._idle),
+                    'minconn': self.minconn,
+                    'maxconn': self.maxconn,
+                    **self._stats}
+
+
+class ReplicaSet:
+    '''
+    Набор пулов соединений с репликами базы данных (серверами только для чтения)
+        replicas - список параметров подключения к репликам: строка DSN
+                   или словарь аргументов psycopg2.connect (например, {'port': 5433})
+        max_lag - допустимое отставание реплики от основного сервера (сек, None - без проверки)
+        check_interval - период (сек) проверки отставания реплики
+        retry_after - время (сек), на которое неисправная реплика исключается из выбора
+        timeout - время ожидания (сек) свободного соединения с репликой; по-умолчанию
+                  реплика с исчерпанным пулом сразу пропускается, и чтение переходит
+                  на следующую реплику или основной сервер
+    Соединения выдаются по очереди (round-robin) из пулов исправных реплик. Реплика
+    признается неисправной при ошибке подключения или запроса и при отставании больше max_lag
+    Остальные именованные аргументы передаются в ConnectionPool каждой реплики;
+    соединения с репликами открываются только при первом обращении
+    '''
+    def __init__(self, replicas:list, max_lag=None, check_interval=5, retry_after=10,
+                 timeout=0, **pool_kwargs):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        # параметры реплики (в том числе разобранные из строки DSN) заменяют
+        # одноименные параметры основного сервера (host, port и т.д.)
+        self.pools = [ConnectionPool(0, timeout=timeout,
+                                     **self._merge(pool_kwargs,
+                                                   psycopg2.extensions.parse_dsn(replica)
+                                                   if isinstance(replica, str) else replica))
+                      for replica in replicas]
+        self._down = [0.0] * len(self.pools)
+        self._checked = [0.0] * len(self.pools)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pools)
+
+    @staticmethod
+    def _merge(pool_kwargs:dict, replica:dict) -> dict:
+        '''
+        Функция объединения параметров подключения основного сервера и реплики
+        Имя базы данных приводится к ключу 'dbname' (psycopg2.connect не принимает
+        'database' и 'dbname' одновременно)
+        '''
+        merged = {}
+        for kwargs in pool_kwargs, replica:
+            merged |= {'dbname' if key == 'database' else key: value
+                       for key, value in kwargs.items()}
+        return merged
+
+    def getconn(self):
+        '''
+        Функция получения соединения с исправной репликой
+        Возвращает кортеж (номер реплики, соединение) или None, если исправных реплик нет
+        '''
+        for _ in range(len(self.pools)):
+            with self._lock:
+                index = self._next % len(self.pools)
+                self._next += 1
+                if self._down[index] > time.monotonic():
+                    continue
+            try:
+                connection = self.pools[index].getconn()
+            except psycopg2.OperationalError as error:
+                self.mark_down(index, error)
+                continue
+            except PoolError as error:
+                logging.info('Реплика %s: %s', index, error)
+                continue
+            try:
+                lag = self._lag(index, connection)
+            except psycopg2.Error as error:
+                self.putconn(index, connection, discard=True)
+                self.mark_down(index, error)
+                continue
+            if lag is not None and lag > self.max_lag:
+                self.putconn(index, connection)
+                self.mark_down(index, f'отставание {lag:.1f} сек')
+                continue
+            return index, connection
+
+    def _lag(self, index:int, connection):
+        '''
+        Функция проверки отставания реплики (не чаще раза в check_interval сек)
+        Возвращает отставание в секундах или None, если проверка не выполнялась
+        '''
+        if self.max_lag is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked[index] < self.check_interval:
+                return
+            self._checked[index] = now
+        with connection.cursor() as cursor:
+            cursor.execute(REPLICA_LAG)
+            lag = cursor.fetchone()[0]
+        connection.rollback()
+        return float(lag)
+
+    def putconn(self, index:int, connection, discard=False):
+        '''
+        Функция возврата соединения в пул реплики
+        '''
+        self.pools[index].putconn(connection, discard=discard)
+
+    def mark_down(self, index:int, reason):
+        '''
+        Функция исключения реплики из выбора на retry_after сек
+        '''
+        with self._lock:
+            self._down[index] = time.monotonic() + self.retry_after
+            self._checked[index] = 0.0
+        logging.warning('Реплика %s исключена из выбора на %s сек - %s',
+                        index, self.retry_after, reason)
+
+    def closeall(self):
+        '''
+        Функция закрытия пулов соединений всех реплик
+        '''
+        for pool in self.pools:
+            pool.closeall()
+
+    def stats(self) -> list:
+        '''
+        Функция получения статистики пулов реплик
+        '''
+        now = time.monotonic()
+        return [{'down': self._down[index] > now, **pool.stats()}
+                for index, pool in enumerate(self.pools)]
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    '''
+    Курсор psycopg2, передающий время выполнения и количество строк каждого запроса
+    в сборщик метрик Instrumentation своего соединения (если он задан)
+    У именованного (серверного) курсора количество строк при выполнении запроса
+    неизвестно, поэтому строки учитываются по мере чтения и передаются при закрытии курсора
+    '''
+    _query = None
+    _fetched = 0
+
+    def execute(self, query, vars=None):
+        if (instrumentation := self.connection.instrumentation) is None:
+            return super().execute(query, vars)
+        if isinstance(query, bytes):
+            text = query[:1000].decode(self.connection.encoding, errors='ignore')
+        else:
+            text = query if isinstance(query, str) else query.as_string(self)
+        start = time.perf_counter()
+        try:
+            super().execute(query, vars)
+        finally:
+            instrumentation.on_query(text, time.perf_counter() - start,
+                                     self.rowcount if self.name is None else 0)
+        if self.name is not None:
+            self._query, self._fetched = text, 0
+        if (instrumentation.explain_rate and text.startswith('EXECUTE pysql_find_by_')
+                and random() < instrumentation.explain_rate):
+            self._explain(instrumentation, text, vars)
+
+    def _explain(self, instrumentation, query, vars):
+        '''
+        Функция получения плана выполнения запроса поиска клиента (EXPLAIN ANALYZE)
+        Выполняется отдельным курсором, чтобы не затронуть результат исходного запроса
+        '''
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {query}', vars)
+            instrumentation.on_explain(query, '\n'.join(row[0] for row in cursor))
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self._query is not None:
+            self._fetched += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size if size is not None else self.arraysize)
+        if self._query is not None:
+            self._fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self._query is not None:
+            self._fetched += len(rows)
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        if self._query is not None:
+            self._fetched += 1
+        return row
+
+    def close(self):
+        if self._fetched and (instrumentation := self.connection.instrumentation) is not None:
+            instrumentation.on_rows(self._query, self._fetched)
+        self._fetched = 0
+        super().close()
+
+
+class RecordCursor(InstrumentedCursor):
+    '''
+    Курсор, выдающий строки вида (client_id, name, surname, mail, [number, ...])
+    сразу в виде записей Client (без промежуточных словарей)
+    '''
+    def fetchone(self):
+        row = super().fetchone()
+        return Client(*row) if row is not None else None
+
+    def fetchmany(self, size=None):
+        return [Client(*row) for row in super().fetchmany(size if size is not None
+                                                          else self.arraysize)]
+
+    def fetchall(self):
+        return [Client(*row) for row in super().fetchall()]
+
+    def __next__(self):
+        # итерация курсора psycopg2 возвращает сам курсор (__iter__), поэтому
+        # записи создаются в __next__ - в том числе для именованных курсоров
+        return Client(*super().__next__())
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    '''
+    Соединение psycopg2 с кэшем имен запросов, подготовленных на сервере (PREPARE)
+    Подготовленные запросы живут до закрытия соединения, поэтому кэш
+    хранится в самом соединении и пропадает вместе с ним
+    Курсоры соединения - InstrumentedCursor; при заданном instrumentation
+    учитываются также время фиксации транзакций
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.instrumentation = None
+        self.cursor_factory = InstrumentedCursor
+
+    def commit(self):
+        if self.instrumentation is None:
+            return super().commit()
+        start = time.perf_counter()
+        super().commit()
+        self.instrumentation.on_commit(time.perf_counter() - start)
+
+
+class _ConnectionState(threading.local):
+    '''
+    Соединение, выданное текущему потоку, и глубина вложенности блоков with
+    '''
+    connection = None
+    depth = 0
+    batch = False
+    stale = ()
+    last_write = float('-inf')
+    primary_reads = 0
+    from_replica = False
 
-import config
 
 class PySQL:
     '''
@@ -14,7 +488,8 @@ class PySQL:
         2. Фамилия (строка, 30 символов)
         3. E-mail (строка, 30 символов)
         4. Номер телефона (строка, строго 10 символов, формат 999 999 99 99)
-    Взаимодействие с методами класса осуществляется путем передачи частично 
+    Взаимодействие с методами класса осуществляется путем передачи записи Client
+    (Phone - для add_phone и delete_phone, см. модуль records) или частично
     заполненного словаря params с имеющейся информацией о клиенте, вида:
         {'client_id': int, 
          'name': str, 
@@ -25,90 +500,431 @@ class PySQL:
          'new_surname': str,
          'new_mail': str,
          'new_number': int или [int, ...]}
+    Соединения с базой данных выдаются из пула ConnectionPool, который создается
+    при первом обращении к базе данных (создание объекта PySQL не открывает соединений):
+        minconn, maxconn - границы размера пула
+        max_idle - время простоя (сек), после которого лишнее соединение закрывается
+    Результаты find_client могут кэшироваться в памяти процесса (ClientCache):
+        cache_size - максимальное количество клиентов в кэше (0 - кэш отключен)
+        cache_ttl - время жизни записи кэша (сек)
+    Метрики методов, запросов, получения соединений и фиксаций транзакций
+    собираются объектом instrumentation (Instrumentation, None - сбор отключен)
+    При records = True методы поиска и чтения возвращают записи Client вместо словарей
+    Запросы чтения (поиск клиентов, iter_clients и выгрузка) могут распределяться
+    между репликами (ReplicaSet):
+        replicas - список параметров подключения к репликам (строка DSN или словарь)
+        max_lag - допустимое отставание реплики (сек)
+        primary_after_write - время (сек) после записи, в течение которого чтение
+                              в том же потоке выполняется на основном сервере
+    Запись, а также чтение внутри блоков with, batch и on_primary выполняются
+    на основном сервере; при недоступности реплик чтение переходит на основной сервер
+    Остальные именованные аргументы (host, port и т.д.) передаются в psycopg2.connect
+    для основного сервера и, если не переопределены, для реплик
     '''
-    def __init__(self, database:str, user:str, password:str):
+    def __init__(self, database:str, user:str, password:str,
+                 minconn=1, maxconn=10, max_idle=300, cache_size=0, cache_ttl=60,
+                 instrumentation=None, records=False, replicas=None, max_lag=None,
+                 primary_after_write=1.0, **connect_kwargs):
         self.database = database
         self.user = user
         self.password = password
-        try:
-            self.connection = self._psyconnect()
-        except UnicodeDecodeError as error:
-            logging.error(f'Ошибка подключения к базе данных "{self.database}" - {error}')
-            sys.exit()
-        else:
-            logging.info(f'Успешное подключение к базе данных "{self.database}". '
-                         'Объект класса connection создан')
-            self.connection.close()
+        self._local = _ConnectionState()
+        self.cache = ClientCache(cache_size, cache_ttl) if cache_size else None
+        self.instrumentation = instrumentation
+        self.records = records
+        self.primary_after_write = primary_after_write
+        self.connect_kwargs = connect_kwargs
+        self.replicas = (ReplicaSet(replicas, max_lag=max_lag, maxconn=maxconn,
+                                    max_idle=max_idle, connection_factory=PreparedConnection,
+                                    database=self.database, user=self.user,
+                                    password=self.password, **connect_kwargs)
+                         if replicas else None)
+        self._pool_params = minconn, maxconn, max_idle
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self) -> ConnectionPool:
+        '''
+        Пул соединений с основным сервером (создается при первом обращении)
+        Ошибка подключения к базе данных передается вызывающему коду
+        '''
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    minconn, maxconn, max_idle = self._pool_params
+                    try:
+                        self._pool = ConnectionPool(minconn, maxconn, max_idle=max_idle,
+                                                    connection_factory=PreparedConnection,
+                                                    database=self.database,
+                                                    user=self.user,
+                                                    password=self.password,
+                                                    **self.connect_kwargs)
+                    except (psycopg2.Error, UnicodeDecodeError) as error:
+                        logging.error('Ошибка подключения к базе данных "%s" - %s',
+                                      self.database, error)
+                        raise
+                    logging.info('Успешное подключение к базе данных "%s". '
+                                 'Пул соединений создан (%s-%s)', self.database, minconn, maxconn)
+        return self._pool
+
+    @property
+    def connection(self) -> psycopg2.extensions.connection:
+        '''
+        Соединение, выданное из пула текущему потоку
+        '''
+        return self._local.connection
 
     def __enter__(self):
         '''
         Метод для работы с объектом connect
         библиотеки psycopg2 как с контекстным менеджером
+        Соединение берется из пула; вложенные блоки with в одном потоке
+        используют уже выданное соединение
         '''
-        self.connection = self._psyconnect()
+        if not self._local.depth:
+            self._local.connection = self._getconn()
+        self._local.depth += 1
+        return self._local.connection
 
     def __exit__(self, exception_type, exception_value, traceback):
         '''
         Метод для работы с объектом connect
         библиотеки psycopg2 как с контекстным менеджером
+        По выходу из внешнего блока with соединение возвращается в пул
+        '''
+        self._local.depth -= 1
+        if self._local.depth:
+            return
+        connection, self._local.connection = self._local.connection, None
+        self.pool.putconn(connection,
+                          discard=isinstance(exception_value, (psycopg2.OperationalError,
+                                                               psycopg2.InterfaceError)))
+
+    def _getconn(self) -> psycopg2.extensions.connection:
+        '''
+        Функция получения соединения из пула с учетом времени ожидания в метриках
         '''
-        self.connection.close()
+        if self.instrumentation is None:
+            connection = self.pool.getconn()
+        else:
+            start = time.perf_counter()
+            connection = self.pool.getconn()
+            self.instrumentation.on_acquire(time.perf_counter() - start)
+        connection.instrumentation = self.instrumentation
+        return connection
 
     def __del__(self):
         'Для красоты'
-        logging.info(f'{'-' * 100}')
+        logging.info('%s', '-' * 100)
 
-    def _psyconnect(self) -> psycopg2.connect:
+    @contextmanager
+    def batch(self):
         '''
-        Функция создания соединения с базой данных
+        Контекстный менеджер пакетного режима (единицы работы)
+        Все вызовы методов add_client, add_phone, change_client, delete_phone,
+        delete_client и т.д. внутри блока with выполняются на одном соединении
+        и фиксируются одной транзакцией по выходу из блока
+        (при исключении транзакция откатывается целиком)
+        Конфликты отдельных запросов (повторяющийся номер, адрес почты) обрабатываются
+        точками сохранения и не откатывают остальные изменения
+        Вложенный вызов batch присоединяется к внешнему
         '''
-        connection = psycopg2.connect(database=self.database,
-                                      user=self.user,
-                                      password=self.password)
-        return connection
+        with self:
+            if self._local.batch:
+                yield self
+                return
+            self._local.batch = True
+            self._local.stale = []
+            try:
+                yield self
+            except BaseException:
+                self.connection.rollback()
+                logging.warning('Пакетная транзакция отменена')
+                raise
+            else:
+                self.connection.commit()
+                self._local.last_write = time.monotonic()
+                logging.info('SUCCESS: Пакетная транзакция зафиксирована')
+            finally:
+                self._local.batch = False
+                stale, self._local.stale = self._local.stale, ()
+                if self.cache is not None:
+                    self.cache.invalidate(*stale)
+
+    def _commit(self):
+        '''
+        Функция фиксации транзакции
+        В пакетном режиме фиксация откладывается до выхода из блока batch
+        '''
+        if not self._local.batch:
+            self.connection.commit()
+            self._local.last_write = time.monotonic()
+
+    def _invalidate(self, *keys):
+        '''
+        Функция удаления из кэша записей о клиентах, затронутых изменением
+        В пакетном режиме записи повторно удаляются по завершении транзакции,
+        чтобы в кэш не попали данные, прочитанные другими потоками до фиксации
+        '''
+        if self.cache is None:
+            return
+        self.cache.invalidate(*keys)
+        if self._local.batch:
+            self._local.stale.extend(keys)
+
+    @contextmanager
+    def on_primary(self):
+        '''
+        Контекстный менеджер чтения с основного сервера
+        Внутри блока with все запросы чтения текущего потока выполняются
+        на основном сервере (например, чтобы гарантированно увидеть свои изменения)
+        '''
+        self._local.primary_reads += 1
+        try:
+            yield self
+        finally:
+            self._local.primary_reads -= 1
+
+    def _replica(self):
+        '''
+        Функция выбора реплики для запроса чтения
+        Возвращает кортеж (номер реплики, соединение) или None, если запрос выполняется
+        на основном сервере: реплики не заданы или неисправны, поток держит соединение
+        (блоки with, batch), включен режим on_primary или после записи в потоке
+        прошло меньше primary_after_write сек
+        '''
+        local = self._local
+        if (self.replicas is None or local.depth or local.primary_reads
+                or time.monotonic() - local.last_write < self.primary_after_write):
+            return
+        start = time.perf_counter()
+        if (replica := self.replicas.getconn()) is not None:
+            replica[1].instrumentation = self.instrumentation
+            if self.instrumentation is not None:
+                self.instrumentation.on_acquire(time.perf_counter() - start)
+        return replica
+
+    def _read(self, function, *args, cursor_factory=None):
+        '''
+        Функция выполнения запроса чтения function(cursor, *args) на реплике (см. _replica)
+        или на основном сервере. При ошибке соединения с репликой она исключается
+        из выбора, а запрос повторяется на другой реплике или на основном сервере
+        Источник результата - в атрибуте from_replica состояния потока: результаты
+        чтения с реплики могут отставать и не помещаются в кэш find_client
+        '''
+        self._local.from_replica = False
+        while (replica := self._replica()) is not None:
+            index, connection = replica
+            try:
+                with connection.cursor(cursor_factory=cursor_factory) as cursor:
+                    result = function(cursor, *args)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+                self.replicas.putconn(index, connection, discard=True)
+                self.replicas.mark_down(index, error)
+                continue
+            except BaseException:
+                self.replicas.putconn(index, connection)
+                raise
+            self.replicas.putconn(index, connection)
+            self._local.from_replica = True
+            return result
+        with self:
+            with self.connection.cursor(cursor_factory=cursor_factory) as cursor:
+                return function(cursor, *args)
+
+    @classmethod
+    def _fetchall(cls, cursor, name:str, *args) -> list:
+        '''
+        Функция выполнения подготовленного запроса name и получения всех строк результата
+        '''
+        cls._execute(cursor, name, *args)
+        return cursor.fetchall()
+
+    def _record(self, client_id, name, surname, mail, number):
+        '''
+        Функция получения результата поиска: записи Client или словаря (см. records)
+        '''
+        if self.records:
+            return Client(client_id, name, surname, mail, number)
+        return {'client_id': client_id, 'name': name, 'surname': surname,
+                'mail': mail, 'number': number}
 
+    @property
+    def _cursor_factory(self):
+        '''
+        Класс курсора для запросов, возвращающих клиентов с массивом номеров
+        '''
+        return RecordCursor if self.records else InstrumentedCursor
+
+    @staticmethod
+    def _execute(cursor, name:str, *args):
+        '''
+        Функция выполнения запроса name из словаря STATEMENTS с параметрами args
+        При первом обращении на данном соединении запрос подготавливается на сервере,
+        повторные вызовы выполняют его без разбора и планирования (EXECUTE)
+        '''
+        if name not in (prepared := cursor.connection.prepared):
+            cursor.execute(f'PREPARE {name} AS {STATEMENTS[name]};')
+            prepared.add(name)
+        cursor.execute(f'EXECUTE {name}({', '.join(['%s'] * len(args))});', args)
+
+    @contextmanager
+    def _savepoint(self, cursor, name='pysql'):
+        '''
+        Контекстный менеджер точки сохранения
+        При ошибке запроса изменения внутри блока откатываются до точки сохранения,
+        остальная часть транзакции сохраняется, исключение пробрасывается дальше
+        '''
+        cursor.execute(f'SAVEPOINT {name};')
+        try:
+            yield
+        except psycopg2.Error:
+            cursor.execute(f'ROLLBACK TO SAVEPOINT {name};')
+            raise
+        cursor.execute(f'RELEASE SAVEPOINT {name};')
+
+    def cache_stats(self) -> dict:
+        '''
+        Функция получения статистики кэша find_client (None, если кэш отключен)
+        '''
+        return self.cache.stats() if self.cache is not None else None
+
+    def metrics(self) -> str:
+        '''
+        Функция выгрузки метрик в текстовом формате Prometheus
+        (включая статистику пула соединений и кэша)
+        Возвращает None, если сбор метрик отключен
+        '''
+        if self.instrumentation is None:
+            return
+        gauges = {f'pysql_pool_{key}': value for key, value in self.pool_stats().items()}
+        if (cache := self.cache_stats()) is not None:
+            gauges |= {f'pysql_cache_{key}': value for key, value in cache.items()}
+        return self.instrumentation.render_prometheus(gauges)
+
+    def pool_stats(self) -> dict:
+        '''
+        Функция получения статистики пула соединений
+        (пустой словарь, если соединения с базой данных еще не открывались)
+        '''
+        return self._pool.stats() if self._pool is not None else {}
+
+    def replica_stats(self) -> list:
+        '''
+        Функция получения статистики пулов реплик (None, если реплики не заданы)
+        '''
+        return self.replicas.stats() if self.replicas is not None else None
+
+    def close(self):
+        '''
+        Функция закрытия пула соединений (и пулов реплик)
+        '''
+        if self._pool is not None:
+            self._pool.closeall()
+        if self.replicas is not None:
+            self.replicas.closeall()
+        logging.info('Пул соединений с базой данных "%s" закрыт', self.database)
+
+    @instrumented
     def delete_table(self):
         '''
         Функция удаления таблиц из базы данных
         '''
         logging.info('Запуск функции (delete_table) '
-                     'удаления таблиц "phone", "client"')
+                     'удаления таблиц "phone", "client", "schema_version"')
         with self:
             with self.connection.cursor() as cursor:
-                for table in 'phone', 'client':
+                for table in 'phone', 'client', 'schema_version':
                     try:
-                        cursor.execute(f'''DROP TABLE {table};''')
-                        self.connection.commit()
-                    except (psycopg2.errors.UndefinedTable, psycopg2.errors.InFailedSqlTransaction):
+                        with self._savepoint(cursor):
+                            cursor.execute(f'''DROP TABLE {table};''')
+                    except psycopg2.errors.UndefinedTable:
                         logging.warning('При удалении возникла ошибка - '
-                                        f'таблицы "{table}" не существует')
+                                        'таблицы "%s" не существует', table)
                     else:
-                        logging.info(f'Таблица "{table}" успешно удалена')
+                        logging.info('Таблица "%s" успешно удалена', table)
+                self._commit()
+        if self.cache is not None:
+            self.cache.clear()
 
+    @instrumented
     def create_table(self):
         '''
         Функция, создающая структуру базы данных (п. 1)
+        Структура создается и обновляется миграциями (см. migrate)
         '''
         logging.info('Запуск функции (create_table) '
                      'создания таблиц "client" и "phone"')
+        self.migrate()
+
+    @instrumented
+    def migrate(self, target=None) -> list:
+        '''
+        Функция применения версионированных миграций из модуля migrations
+        Применяются все еще не примененные миграции с номером версии не больше target
+        (по-умолчанию - все). Подходит и для пустой базы данных, и для обновления
+        уже заполненной базы данных на месте
+        Возвращает список номеров примененных миграций
+        '''
+        logging.info('Запуск функции (migrate) '
+                     'применения миграций до версии: %s', target or 'последней')
+        if self._local.batch:
+            logging.error('Миграции не могут выполняться в пакетном режиме batch')
+            return []
+        done = []
         with self:
-            with self.connection.cursor() as cursor:
-                cursor.execute('''
-                                CREATE TABLE IF NOT EXISTS client(
-                                    client_id SERIAL primary key,
-                                    name VARCHAR(30) NOT NULL,
-                                    surname VARCHAR(30) NOT NULL,
-                                    mail VARCHAR(30) NOT NULL UNIQUE);
-                                ''')
-                cursor.execute('''
-                                CREATE TABLE IF NOT EXISTS phone(
-                                    phone_id SERIAL primary key,
-                                    client_id INTEGER REFERENCES client(client_id),
-                                    number VARCHAR(10) UNIQUE CHECK(char_length(number) = 10));
-                                ''')
-                self.connection.commit()
-                logging.info('SUCCESS: Таблицы "client" и "phone" созданы')
+            connection = self.connection
+            connection.rollback()
+            connection.autocommit = True
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_lock(%s);', (MIGRATION_LOCK,))
+                    try:
+                        cursor.execute(SCHEMA_VERSION_TABLE)
+                        cursor.execute('SELECT version FROM schema_version;')
+                        applied = {version for version, in cursor.fetchall()}
+                        for migration in MIGRATIONS:
+                            if (migration.version in applied
+                                    or target is not None and migration.version > target):
+                                continue
+                            logging.info('Применение миграции %s: %s',
+                                         migration.version, migration.description)
+                            self._apply_migration(cursor, migration)
+                            done.append(migration.version)
+                    finally:
+                        cursor.execute('SELECT pg_advisory_unlock(%s);', (MIGRATION_LOCK,))
+            finally:
+                connection.autocommit = False
+        if done:
+            logging.info('SUCCESS: Применены миграции: %s', ', '.join(map(str, done)))
+        else:
+            logging.info('Структура базы данных в актуальном состоянии')
+        return done
+
+    @staticmethod
+    def _apply_migration(cursor, migration):
+        '''
+        Функция применения одной миграции на соединении в режиме autocommit
+        Транзакционная миграция выполняется целиком или не выполняется вовсе
+        '''
+        if migration.transactional:
+            cursor.execute('BEGIN;')
+        try:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute('''
+                           INSERT INTO schema_version(version, description)
+                           VALUES (%s, %s);
+                           ''', (migration.version, migration.description))
+        except psycopg2.Error:
+            if migration.transactional:
+                cursor.execute('ROLLBACK;')
+            raise
+        if migration.transactional:
+            cursor.execute('COMMIT;')
 
+    @instrumented
     def add_client(self, params:dict):
         '''
         Функция добавления информации о клиенте (п. 2)
@@ -117,7 +933,7 @@ class PySQL:
         по ключам 'name', 'surname' и 'mail'
         '''
         logging.info('Запуск функции (add_client) '
-                     f'добавления информации: {params}')
+                     'добавления информации: %s', params)
         try:
             name = params['name']
             surname = params['surname']
@@ -129,59 +945,70 @@ class PySQL:
             return
         with self:
             with self.connection.cursor() as cursor:
-                cursor.execute(f'''
-                                INSERT INTO client(name, surname, mail)
-                                VALUES ('{name.title()}', '{surname.title()}', '{mail}')
-                                RETURNING client_id;
-                                ''')
-                client_id = cursor.fetchone()[0]
-                self.connection.commit()
-        logging.info(f'SUCCESS: Информация о клиенте {surname} {name} добавлена в таблицу '
-                     f'"client". Идентификатор клиента - {client_id}')
+                try:
+                    with self._savepoint(cursor):
+                        self._execute(cursor, 'pysql_insert_client',
+                                      name.title(), surname.title(), mail)
+                        client_id = cursor.fetchone()[0]
+                except psycopg2.errors.UniqueViolation:
+                    logging.warning('Адрес почты %s уже существует в базе данных', mail)
+                    return
+                self._commit()
+        logging.info('SUCCESS: Информация о клиенте %s %s добавлена в таблицу '
+                     '"client". Идентификатор клиента - %s', surname, name, client_id)
         if numbers:
             params = {'new_number': numbers}
             self.add_phone(params, _existance=client_id)
 
+    @instrumented
     def add_phone(self, params:dict, _existance=None):
         '''
         Функция добавления номера телефона (п. 3)
         Подразумевается работа с таблицей "phone"
         Для добавления информации, в словарь params, помимо идентификационной информации, 
         необходимо внести дополнительный параметр по ключу 'new_number'
+        Вместо словаря может передаваться запись Phone (номер и client_id владельца)
+        или запись Client - тогда добавляются все номера записи
         Параметр _existance может принимать значение client_id, 
         в таком случае пропускается поиск клиента в таблице "client"
         '''
         logging.info('Запуск функции (add_phone) '
-                     f'добавления номера телефона: {params}')
+                     'добавления номера телефона: %s', params)
+        match params:
+            case Phone(number=number, client_id=client_id):
+                numbers, params = [number], {'client_id': client_id}
+            case Client(number=numbers):
+                params = Client(params.client_id, params.name, params.surname, params.mail)
+            case _:
+                numbers = params.get('new_number')
         client_id = _existance if _existance else self.find_client(params, _id_only=True)
         if not client_id:
             return
-        if isinstance(numbers := params.get('new_number'), int):
+        if isinstance(numbers, (int, str)):
             numbers = [numbers]
-        phones, denial = [], []
+        checked = validate_numbers(numbers or [])
+        denial = [f'{value} ({reason})' for _, value, reason in checked.rejected]
+        phones = []
         with self:
             with self.connection.cursor() as cursor:
-                for number in numbers:
-                    if len(str(number)) >= 10:
-                        try:
-                            cursor.execute(f'''
-                                            INSERT INTO phone(client_id, number)
-                                            VALUES ('{client_id}', '{str(number)[-10:]}');
-                                            ''')
-                            self.connection.commit()
-                            phones.append(number)
-                        except psycopg2.errors.UniqueViolation:
-                            logging.warning(f'Номер {number} уже существует в базе данных')
+                for number in checked.clean:
+                    self._execute(cursor, 'pysql_insert_phone', client_id, number)
+                    if cursor.fetchone():
+                        phones.append(number)
                     else:
-                        denial.append(number)
+                        logging.warning('Номер %s уже существует в базе данных', number)
+                self._commit()
+                if phones:
+                    self._invalidate(('client_id', client_id))
                 if denial:
                     logging.warning('Ошибка ввода номера(ов) '
-                                    f'для добавления: {', '.join(map(str, denial))}')
+                                    'для добавления: %s', ', '.join(map(str, denial)))
                 if phones:
-                    logging.info(f'SUCCESS: Номер(а) {', '.join(map(str, phones))} '
-                                 'добавлен(ы) в таблицу "phone"')
+                    logging.info('SUCCESS: Номер(а) %s '
+                                 'добавлен(ы) в таблицу "phone"', ', '.join(map(str, phones)))
 
-    def change_client(self, params:dict):
+    @instrumented
+    def change_client(self, params:dict, changes=None):
         '''
         Функция изменения данных о клиенте (п. 4)
         Подразумевается работа с таблицей "client" и "phone" (опционально)
@@ -191,53 +1018,59 @@ class PySQL:
         В связи с тем, что к одному клиенту могут быть привязаны несколько номеров,
         в словаре params, в качестве значения ключа 'number' обязательно
         необходимо указать номер телефона, который будет заменен на значение ключа 'new_number'
+        Новые значения могут передаваться и отдельно в changes - записью Client
+        или словарем с ключами 'name', 'surname', 'mail', 'number' (тогда params,
+        как и запись Client, содержит только идентификационную информацию)
         '''
         logging.info('Запуск функции (change_client) '
-                     f'изменения информации: {params}')
+                     'изменения информации: %s %s', params, changes or '')
         client_id = self.find_client(params, _id_only=True)
         if not client_id:
             return
-        new_params = {key[4:]:value for key, value in params.items() if 'new_' in key}
+        source, prefix = (params, 'new_') if changes is None else (changes, '')
+        new_params = {key: value for key in ('name', 'surname', 'mail', 'number')
+                      if (value := source.get(prefix + key))}
+        if isinstance(new_params.get('number'), list):
+            new_params['number'] = new_params['number'][0]
+        if isinstance(old_number := params.get('number'), list):
+            old_number = old_number[0] if old_number else None
         flag = 0
         with self:
             with self.connection.cursor() as cursor:
                 for key, value in new_params.items():
-                    if key == 'number' and params.get('number'):
-                        if len(str(value)) < 10:
-                            logging.warning(f'Ошибка ввода номера: {value}')
+                    if key == 'number':
+                        if not old_number:
+                            logging.warning('Не указан заменяемый номер телефона (number)')
                             continue
-                        cursor.execute(f'''
-                                       SELECT phone_id
-                                        FROM phone
-                                        WHERE number = '{params['number']}';
-                                        ''')
+                        if (number := validate_numbers([value]).values[0]) is None:
+                            logging.warning('Ошибка ввода номера: %s', value)
+                            continue
+                        self._execute(cursor, 'pysql_select_phone_id', str(old_number))
                         if phone_id := cursor.fetchone():
                             phone_id = phone_id[0]
                             try:
-                                cursor.execute(f'''
-                                                UPDATE phone
-                                                SET {key} = '{str(value)[-10:]}'
-                                                WHERE phone_id = {phone_id}
-                                                ''')
+                                with self._savepoint(cursor):
+                                    self._execute(cursor, 'pysql_update_phone',
+                                                  number, phone_id)
                                 flag += 1
-                                self.connection.commit()
                             except psycopg2.errors.UniqueViolation:
-                                logging.warning(f'Номер {str(value)[-10:]} уже существует в '
-                                                'базе данных')
+                                logging.warning('Номер %s уже существует в '
+                                                'базе данных', number)
                     else:
                         try:
-                            cursor.execute(f'''
-                                            UPDATE client
-                                            SET {key} = '{value}'
-                                            WHERE client_id = {client_id};
-                                            ''')
+                            with self._savepoint(cursor):
+                                self._execute(cursor, f'pysql_update_client_{key}',
+                                              value, client_id)
                             flag += 1
-                            self.connection.commit()
                         except psycopg2.errors.UniqueViolation:
-                            logging.warning(f'Адрес почты {value} уже существует в базе данных')
+                            logging.warning('Адрес почты %s уже существует в базе данных', value)
+                self._commit()
         if flag:
-            logging.info(f'SUCCESS: Информация о клиенте обновлена')
+            self._invalidate(('client_id', client_id),
+                             *([('number', str(old_number))] if old_number else []))
+            logging.info('SUCCESS: Информация о клиенте обновлена')
 
+    @instrumented
     def delete_phone(self, params:dict, _all_numbers=False):
         '''
         Функция удаления телефона (п. 5)
@@ -245,75 +1078,247 @@ class PySQL:
         При _all_numbers = True, params принимает значение client_id - 
         в таком случае осуществляется удаление всех телефонных номеров по client_id из таблицы
         Удаляются номера, являющиеся значениями ключа 'number' словаря params
+        (или номер записи Phone, номера записи Client)
         '''
         if _all_numbers:
             client_id = params
             logging.info('Запуск функции (delete_phone) удаления '
-                         f'всех номеров телефона по идентификатору: {client_id}')
+                         'всех номеров телефона по идентификатору: %s', client_id)
         else:
-            if numbers := params.get('number'):
-                if isinstance(numbers, int):
+            if numbers := (params.number if isinstance(params, Phone) else params.get('number')):
+                if isinstance(numbers, (int, str)):
                     numbers = [numbers]
                 logging.info('Запуск функции (delete_phone) удаления '
-                             f'номеров телефона: {params}')
+                             'номеров телефона: %s', params)
             else:
-                logging.warning(f'Ошибка входных данных: {numbers}')
+                logging.warning('Ошибка входных данных: %s', numbers)
                 return
         with self:
             with self.connection.cursor() as cursor:
                 if _all_numbers:
-                    cursor.execute(f'''
-                                    DELETE FROM phone
-                                    WHERE client_id = {client_id} RETURNING *;
-                                    ''')
+                    self._execute(cursor, 'pysql_delete_client_phones', client_id)
                     if cursor.fetchone():
                         logging.info('SUCCESS: Информация о номерах телефона клиента '
-                                     f'({client_id}) удалена из таблицы "phone"')
+                                     '(%s) удалена из таблицы "phone"', client_id)
                     else:
-                        logging.info(f'Информация о номерах телефона клиента ({client_id}) '
-                                     'не найдена')
-                    self.connection.commit()
+                        logging.info('Информация о номерах телефона клиента (%s) '
+                                     'не найдена', client_id)
+                    self._commit()
+                    self._invalidate(('client_id', client_id))
 
                     return
                 phones = []
                 for number in numbers:
-                    cursor.execute(f'''
-                                    DELETE FROM phone
-                                    WHERE number = '{number}' RETURNING number;
-                                    ''')
+                    self._execute(cursor, 'pysql_delete_phone', str(number))
                     if phone := cursor.fetchone():
                         phones.append(phone[0])
-                self.connection.commit()
+                self._commit()
+                self._invalidate(*(('number', number) for number in phones))
         if phones:
-            logging.info(f'SUCCESS: Из таблицы "phone" удален(ы) номер(а): {' '.join(phones)}')
+            logging.info('SUCCESS: Из таблицы "phone" удален(ы) номер(а): %s', ' '.join(phones))
         else:
             logging.info('В таблице "phone" данные номера отсутствуют')
 
+    @instrumented
     def delete_client(self, params:dict):
         '''
         Функция удаления информации о клиенте (п. 6)
         Подразумевается работа с таблицами "client" (всегда) и "phone" (опционально)
         Удаление осуществляется по какой-либо идентификационной информации,
         переданной в словаре params: 'client_id', 'name' и 'surname', 'mail', 'number'
+        Номера телефона клиента удаляются каскадно (ON DELETE CASCADE, см. migrate)
         '''
         logging.info('Запуск функции (delete_client) '
-                     f'удаления информации: {params}')
+                     'удаления информации: %s', params)
         client_id = (params['client_id'] if params.get('client_id')
                      else self.find_client(params, _id_only=True))
-        self.delete_phone(client_id, _all_numbers=True)
+        if not client_id:
+            return
         with self:
             with self.connection.cursor() as cursor:
-                cursor.execute(f'''
-                                DELETE FROM client
-                                WHERE client_id = {client_id} RETURNING *;
-                                ''')
+                self._execute(cursor, 'pysql_delete_client', client_id)
                 if cursor.fetchone():
-                    logging.info(f'SUCCESS: Информация о клиенте ({client_id}) '
-                                 'удалена из таблицы "client"')
+                    logging.info('SUCCESS: Информация о клиенте (%s) '
+                                 'удалена из таблицы "client"', client_id)
                 else:
                     logging.info('Информация о клиенте отсутствует')
-                self.connection.commit()
+                self._commit()
+        self._invalidate(('client_id', client_id))
+
+    @instrumented
+    def import_clients(self, source, batch_size=1000) -> dict:
+        '''
+        Функция потоковой загрузки информации о клиентах
+        Параметр source принимает путь к файлу CSV или JSONL, открытый файл
+        или любой итерируемый объект со словарями params
+        В CSV-файле ожидаются столбцы 'name', 'surname', 'mail' и 'number'
+        (несколько номеров разделяются пробелом, запятой или точкой с запятой)
+        Записи обрабатываются пачками по batch_size: клиенты добавляются одним запросом,
+        номера телефона привязываются к полученным идентификаторам клиентов,
+        пачка фиксируется одной транзакцией (в пакетном режиме batch - вместе с внешней)
+        Ошибочные записи и номера не прерывают загрузку, а попадают в отчет
+        (в порядке номеров записей; для нечитаемой строки JSONL params - текст строки):
+            {'clients': int, 'phones': int,
+             'rejected': [{'row': int, 'params': dict, 'reason': str}, ...]}
+        '''
+        logging.info('Запуск функции (import_clients) '
+                     'загрузки информации о клиентах: %s', source)
+        report = {'clients': 0, 'phones': 0, 'rejected': []}
+        rows = enumerate(_read_clients(source), 1)
+        with self:
+            with self.connection.cursor() as cursor:
+                while batch := list(islice(rows, batch_size)):
+                    self._import_batch(cursor, batch, report)
+        report['rejected'].sort(key=lambda item: item['row'])
+        if report['rejected']:
+            logging.warning('Отклонено записей при загрузке: %s', len(report['rejected']))
+        logging.info('SUCCESS: Загружено клиентов - %s, '
+                     'номеров телефона - %s', report['clients'], report['phones'])
+        return report
+
+    def _import_batch(self, cursor, batch, report):
+        '''
+        Функция загрузки пачки записей (row, params) в таблицы "client" и "phone"
+        При ошибке базы данных пачка откатывается до точки сохранения и загружается построчно
+        '''
+        clients, rejected = [], []
+        for (row, params), reason in zip(batch, _check_clients([params for _, params in batch])):
+            if isinstance(reason, str):
+                rejected.append(_rejected(row, params, reason))
+            else:
+                clients.append((row, params, *reason))
+        if not clients:
+            report['rejected'].extend(rejected)
+            return
+        added_clients = added_phones = 0
+        try:
+            with self._savepoint(cursor, 'pysql_import'):
+                inserted = execute_values(cursor, '''
+                                          INSERT INTO client(name, surname, mail)
+                                          VALUES %s
+                                          ON CONFLICT (mail) DO NOTHING
+                                          RETURNING mail, client_id;
+                                          ''',
+                                          [(name, surname, mail)
+                                           for _, _, name, surname, mail, _ in clients],
+                                          page_size=len(clients), fetch=True)
+                client_ids = dict(inserted)
+                phones, owners = [], {}
+                for row, params, _, _, mail, numbers in clients:
+                    if (client_id := client_ids.pop(mail, None)) is None:
+                        rejected.append({'row': row, 'params': params,
+                                         'reason': f'Адрес почты {mail} уже существует'})
+                        continue
+                    added_clients += 1
+                    for number in numbers:
+                        phones.append((client_id, number))
+                        owners.setdefault(number, []).append((row, params))
+                if phones:
+                    added = execute_values(cursor, '''
+                                           INSERT INTO phone(client_id, number)
+                                           VALUES %s
+                                           ON CONFLICT (number) DO NOTHING
+                                           RETURNING number;
+                                           ''',
+                                           phones, page_size=len(phones), fetch=True)
+                    for (number,) in added:
+                        owners[number].pop(0)
+                        added_phones += 1
+                    for number, duplicates in owners.items():
+                        rejected.extend({'row': row, 'params': params,
+                                         'reason': f'Номер {number} уже существует'}
+                                        for row, params in duplicates)
+            self._commit()
+        except psycopg2.DatabaseError as error:
+            if len(batch) == 1:
+                row, params = batch[0]
+                report['rejected'].append({'row': row, 'params': params,
+                                           'reason': str(error).strip()})
+                return
+            logging.warning('Ошибка загрузки пачки записей, '
+                            'переход к построчной загрузке - %s', error)
+            for record in batch:
+                self._import_batch(cursor, [record], report)
+            return
+        report['clients'] += added_clients
+        report['phones'] += added_phones
+        report['rejected'].extend(rejected)
+
+    @instrumented
+    def sync_clients(self, source, delete=True, chunk_size=10000) -> dict:
+        '''
+        Функция синхронизации таблиц с полным снимком списка клиентов
+        (например, ежедневной выгрузкой из внешней системы)
+        Параметр source принимает то же, что и import_clients; клиенты снимка
+        сопоставляются с клиентами базы данных по адресу почты
+        Снимок загружается командой COPY во временные таблицы частями по chunk_size записей,
+        после чего изменения применяются несколькими запросами над множествами строк
+        в одной транзакции (в пакетном режиме batch - вместе с внешней):
+            - удаляются клиенты, отсутствующие в снимке (при delete = False - сохраняются)
+            - обновляются имя и фамилия, добавляются новые клиенты
+            - номера телефона переносятся к новому владельцу, удаляются и добавляются
+        Ошибочные записи, повторы адресов почты и номеров попадают в отчет; клиент
+        с ошибочной записью не изменяется и не удаляется
+        Возвращает отчет:
+            {'clients_deleted': int, 'clients_updated': int, 'clients_inserted': int,
+             'phones_moved': int, 'phones_deleted': int, 'phones_inserted': int,
+             'rejected': [{'row': int, 'params': dict, 'reason': str}, ...]}
+        '''
+        logging.info('Запуск функции (sync_clients) '
+                     'синхронизации информации о клиентах: %s', source)
+        report = dict.fromkeys(SYNC_STATEMENTS, 0)
+        rejected = report['rejected'] = []
+        rows = enumerate(_read_clients(source), 1)
+        mails, numbers = set(), set()
+        with self:
+            with self.connection.cursor() as cursor:
+                cursor.execute(SYNC_TABLES)
+                while chunk := list(islice(rows, chunk_size)):
+                    clients, phones = io.StringIO(), io.StringIO()
+                    client_writer, phone_writer = csv.writer(clients), csv.writer(phones)
+                    checks = _check_clients([params for _, params in chunk])
+                    for (row, params), reason in zip(chunk, checks):
+                        if isinstance(reason, str):
+                            rejected.append(_rejected(row, params, reason))
+                            mail = params.get('mail') if isinstance(params, dict) else None
+                            if isinstance(mail, str) and 0 < len(mail) <= 30 and mail not in mails:
+                                mails.add(mail)
+                                client_writer.writerow((row, None, None, mail, False))
+                            continue
+                        name, surname, mail, client_numbers = reason
+                        if mail in mails:
+                            rejected.append({'row': row, 'params': params,
+                                             'reason': f'Адрес почты {mail} повторяется в снимке'})
+                            continue
+                        mails.add(mail)
+                        client_writer.writerow((row, name, surname, mail, True))
+                        for number in client_numbers:
+                            if number in numbers:
+                                rejected.append({'row': row, 'params': params,
+                                                 'reason': f'Номер {number} повторяется в снимке'})
+                                continue
+                            numbers.add(number)
+                            phone_writer.writerow((mail, number))
+                    clients.seek(0)
+                    phones.seek(0)
+                    cursor.copy_expert(SYNC_COPY_CLIENTS, clients)
+                    cursor.copy_expert(SYNC_COPY_PHONES, phones)
+                cursor.execute('ANALYZE sync_client, sync_phone;')
+                for name, statement in SYNC_STATEMENTS.items():
+                    if name == 'clients_deleted' and not delete:
+                        continue
+                    cursor.execute(statement)
+                    report[name] = cursor.rowcount
+                self._commit()
+        if self.cache is not None:
+            self.cache.clear()
+        if rejected:
+            logging.warning('Отклонено записей при синхронизации: %s', len(rejected))
+        logging.info('SUCCESS: Синхронизация завершена - %s',
+                     ', '.join(f'{name}: {report[name]}' for name in SYNC_STATEMENTS))
+        return report
 
+    @instrumented
     def find_client(self, params:dict, _id_only=False) -> dict:
         '''
         Функция поиска данных о клиенте по введенным параметрам (п. 7)
@@ -327,109 +1332,484 @@ class PySQL:
         Если _id_only = False (по-умолчанию), функция вернет словарь с полной информацией о клиенте 
         '''
         logging.info('Запуск функции (find_client) '
-                     f'поиска информации: {params}')
+                     'поиска информации: %s', params)
         if _id_only and params.get('client_id'):
             return params['client_id']
-        if client_id := params.get('client_id'):
-            info = self._find_client_w_id(client_id)
-        elif mail := params.get('mail'):
-            info = self._find_client_w_mail(mail)
-        elif params.get('number'):
-            number = params['number'][0] if isinstance(params['number'], list) else params['number']
-            info = self._find_client_w_numbers(number)
-        elif params.get('name') and params.get('surname'):
-            info = self._find_client_w_name(params['name'], params['surname'])
-        else:
+        if (key := lookup_key(params)) is None:
             logging.warning('Недостаточно данных для поиска информации о клиенте в базе данных. '
                             'Дальнейший поиск невозможен')
             return
+        if self.cache is not None and (result := self.cache.get(key)):
+            logging.info('SUCCESS: Информация о клиенте (из кэша): %s', result)
+            return result['client_id'] if _id_only else result
+        # идентификатор нужен методам изменения данных - он ищется на основном сервере
+        with self.on_primary() if _id_only else nullcontext():
+            match key:
+                case ('client_id', client_id):
+                    info = self._find_client_w_id(client_id)
+                case ('mail', mail):
+                    info = self._find_client_w_mail(mail)
+                case ('number', number):
+                    info = self._find_client_w_numbers(number)
+                case ('name', name, surname):
+                    info = self._find_client_w_name(name, surname)
         if info:
             tmp, *_ = info
+            result = self._record(*tmp[:4], [tup[4] for tup in info if tup[4] and tup[0] == tmp[0]])
+            if self.cache is not None and not self._local.from_replica:
+                self.cache.put(result)
             if _id_only:
                 return tmp[0]
-            result = dict(zip(('client_id', 'name', 'surname', 'mail'), tmp))
-            result['number'] = [tup[4] for tup in info if tup[4]]
-            logging.info(f'SUCCESS: Информация о клиенте: {result}')
+            logging.info('SUCCESS: Информация о клиенте: %s', result)
             return result
 
+    @instrumented
+    def find_clients(self, params_list:list) -> list:
+        '''
+        Функция множественного поиска данных о клиентах
+        Параметр params_list принимает список словарей params (см. find_client)
+        Ключи поиска группируются по типу ('client_id', 'mail', 'number', 'name' и 'surname'),
+        каждая группа разрешается одним запросом независимо от количества ключей
+        Возвращает список результатов в порядке входных данных,
+        для ненайденных клиентов (и некорректных словарей params) - None
+        '''
+        logging.info('Запуск функции (find_clients) '
+                     'поиска информации о клиентах: %s шт.', len(params_list))
+        results = [None] * len(params_list)
+        groups = {}
+        for position, params in enumerate(params_list):
+            if (key := lookup_key(params)) is None:
+                logging.warning('Недостаточно данных для поиска информации о клиенте: %s', params)
+                continue
+            if self.cache is not None and (result := self.cache.get(key)):
+                results[position] = result
+                continue
+            groups.setdefault(key[0], {}).setdefault(key[1:], []).append(position)
+
+        def fetch(cursor):
+            return [(lookups, len(next(iter(lookups))),
+                     self._fetchall(cursor, f'pysql_find_many_by_{kind}',
+                                    *map(list, zip(*lookups))))
+                    for kind, lookups in groups.items()]
+
+        found = self._read(fetch) if groups else ()
+        cache = self.cache if not self._local.from_replica else None
+        for lookups, width, rows in found:
+            for row in rows:
+                result = self._record(*row[width:])
+                if cache is not None:
+                    cache.put(result)
+                for position in lookups.get(row[:width], ()):
+                    results[position] = copy_client(result)
+        logging.info('SUCCESS: Найдено клиентов: '
+                     '%s из %s', sum(result is not None for result in results), len(results))
+        return results
+
+    @instrumented
+    def search_clients(self, query:str, limit=20, after=None, prefix=False, fields=None) -> dict:
+        '''
+        Функция поиска клиентов по части имени, фамилии, адреса почты или номера телефона
+        Параметр query принимает искомую строку (без учета регистра; номер телефона
+        ищется по цифрам строки), prefix = True - поиск по началу значения
+        (например, "фамилия начинается с"), fields - перечень полей поиска
+        из 'name', 'surname', 'mail', 'number' (по-умолчанию - все)
+        Результаты упорядочены по client_id и выдаются страницами по limit клиентов;
+        для получения следующей страницы в after передается значение 'next'
+        предыдущего результата (постраничный вывод по ключу, без OFFSET)
+        Поиск использует триграммные индексы (см. migrate) и эффективен
+        для строк не короче 3 символов
+        Возвращает словарь {'clients': [dict или Client, ...], 'next': int или None}
+        '''
+        logging.info('Запуск функции (search_clients) '
+                     'поиска клиентов: %r (после %s)', query, after)
+        if limit < 1:
+            logging.warning('Некорректный размер страницы: %s', limit)
+            return {'clients': [], 'next': None}
+        fields = fields or tuple(SEARCH_BRANCHES)
+        if unknown := set(fields) - set(SEARCH_BRANCHES):
+            logging.warning('Неизвестные поля поиска: %s', ', '.join(sorted(unknown)))
+            return {'clients': [], 'next': None}
+        text = re.sub(r'([\\%_])', r'\\\1', query.strip())
+        digits = re.sub(r'\D', '', query) if re.fullmatch(r'[\d\s()+-]+', query.strip()) else ''
+        branches = [SEARCH_BRANCHES[field] for field in fields
+                    if (digits if field == 'number' else text)]
+        if not branches:
+            logging.warning('Пустая строка поиска')
+            return {'clients': [], 'next': None}
+        values = {'pattern': f'{text}%' if prefix else f'%{text}%',
+                  'number_pattern': f'{digits}%' if prefix else f'%{digits}%',
+                  'after': after or 0,
+                  'limit': limit}
+        statement = sql.SQL(SEARCH_CLIENTS).format(
+            matched=sql.SQL(' UNION ').join(map(sql.SQL, branches)))
+
+        def fetch(cursor):
+            cursor.execute(statement, values)
+            return [client if self.records else dict(zip(FIELDS, client)) for client in cursor]
+
+        clients = self._read(fetch, cursor_factory=self._cursor_factory)
+        logging.info('SUCCESS: Найдено клиентов на странице: %s', len(clients))
+        return {'clients': clients,
+                'next': clients[-1]['client_id'] if len(clients) == limit else None}
+
+    @instrumented
+    def iter_clients(self, filter=None, itersize=2000):
+        '''
+        Функция-генератор последовательного чтения информации о клиентах
+        Параметр filter принимает словарь с условиями отбора по точному совпадению
+        значений ключей 'client_id' (int или [int, ...]), 'name', 'surname', 'mail'
+        (по-умолчанию - все клиенты)
+        Чтение выполняется серверным (именованным) курсором пачками по itersize строк
+        на отдельном соединении пула (или реплики, см. ReplicaSet), а внутри блоков with
+        и batch - на соединении потока (с учетом незафиксированных изменений),
+        поэтому память не зависит от размера таблицы,
+        а первые записи выдаются сразу. Номера телефона собираются в SQL
+        Записи выдаются в порядке client_id в виде словарей (при records = True - Client)
+            {'client_id': int, 'name': str, 'surname': str, 'mail': str, 'number': [str, ...]}
+        '''
+        logging.info('Запуск функции (iter_clients) '
+                     'чтения информации о клиентах: %s', filter)
+        conditions, values = [], []
+        for key, value in (filter or {}).items():
+            if key not in ('client_id', 'name', 'surname', 'mail'):
+                logging.warning('Неизвестный параметр отбора: %s', key)
+                return
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(sql.SQL('c.{} = ANY(%s)').format(sql.Identifier(key)))
+                value = list(value)
+            else:
+                conditions.append(sql.SQL('c.{} = %s').format(sql.Identifier(key)))
+            values.append(value)
+        where = (sql.SQL('WHERE ') + sql.SQL(' AND ').join(conditions)
+                 if conditions else sql.SQL(''))
+        query = sql.SQL(ITER_CLIENTS).format(where=where)
+        if self._local.depth:
+            yield from self._iter_rows(self.connection, query, values, itersize)
+            return
+        if (replica := self._replica()) is not None:
+            index, connection = replica
+        else:
+            index, connection = None, self._getconn()
+        discard = False
+        try:
+            yield from self._iter_rows(connection, query, values, itersize)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as error:
+            discard = True
+            if index is not None:
+                self.replicas.mark_down(index, error)
+            raise
+        finally:
+            if index is None:
+                self.pool.putconn(connection, discard=discard)
+            else:
+                self.replicas.putconn(index, connection, discard=discard)
+
+    def _iter_rows(self, connection, query, values:list, itersize:int):
+        '''
+        Функция-генератор чтения записей о клиентах именованным курсором на соединении connection
+        '''
+        with connection.cursor(name=f'pysql_iter_clients_{next(_ITER_IDS)}',
+                               cursor_factory=self._cursor_factory) as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, values)
+            if self.records:
+                yield from cursor
+            else:
+                for row in cursor:
+                    yield dict(zip(FIELDS, row))
+
+    @instrumented
+    def export_csv(self, target, filter=None, itersize=2000) -> int:
+        '''
+        Функция выгрузки информации о клиентах в файл CSV
+        Параметр target принимает путь к файлу или открытый файл, filter - см. iter_clients
+        Несколько номеров телефона записываются через точку с запятой
+        (формат, принимаемый import_clients). Возвращает количество выгруженных клиентов
+        '''
+        with _open_target(target) as file:
+            writer = csv.writer(file)
+            writer.writerow(('client_id', 'name', 'surname', 'mail', 'number'))
+            count = 0
+            for client in self.iter_clients(filter, itersize):
+                writer.writerow((client['client_id'], client['name'], client['surname'],
+                                 client['mail'], ';'.join(client['number'])))
+                count += 1
+        logging.info('SUCCESS: Выгружено клиентов в CSV: %s', count)
+        return count
+
+    @instrumented
+    def export_jsonl(self, target, filter=None, itersize=2000) -> int:
+        '''
+        Функция выгрузки информации о клиентах в файл JSONL (одна запись в строке)
+        Параметр target принимает путь к файлу или открытый файл, filter - см. iter_clients
+        Возвращает количество выгруженных клиентов
+        '''
+        with _open_target(target) as file:
+            count = 0
+            for client in self.iter_clients(filter, itersize):
+                file.write(json.dumps(dict(client), ensure_ascii=False) + '\n')
+                count += 1
+        logging.info('SUCCESS: Выгружено клиентов в JSONL: %s', count)
+        return count
+
     def _find_client_w_id(self, client_id):
         '''
         Функция поиска информации о клиенте по идентификатору
         '''
-        logging.info(f'Выполняется поиск информации по идентификатору клиента: {client_id}')
-        with self:
-            with self.connection.cursor() as cursor:
-                cursor.execute(f'''
-                                SELECT c.client_id, name, surname, mail, number
-                                FROM client AS c 
-                                LEFT JOIN phone AS p ON c.client_id = p.client_id 
-                                WHERE c.client_id = {client_id};
-                                ''')
-                if result := cursor.fetchall():
-                    return result
-                logging.warning(f'По идентификатору ({client_id}) клиент не найден')
+        logging.info('Выполняется поиск информации по идентификатору клиента: %s', client_id)
+        if result := self._read(self._fetchall, 'pysql_find_by_id', client_id):
+            return result
+        logging.warning('По идентификатору (%s) клиент не найден', client_id)
 
     def _find_client_w_numbers(self, number):
         '''
         Функция поиска информации о клиенте по номеру(ам) телефона
         '''
-        logging.info(f'Выполняется поиск информации по номеру телефона: {number}')
-        with self:
-            with self.connection.cursor() as cursor:
-                cursor.execute(f'''
-                                SELECT c.client_id, name, surname, mail, number
-                                FROM client AS c 
-                                LEFT JOIN phone AS p ON c.client_id = p.client_id 
-                                WHERE number = '{number}';
-                                ''')
-                if result := cursor.fetchone():
-                    client_id = result[0]
-                    return self._find_client_w_id(client_id)
-                logging.warning(f'По номеру телефона ({number}) клиент не найден')
+        logging.info('Выполняется поиск информации по номеру телефона: %s', number)
+        if result := self._read(self._fetchall, 'pysql_find_by_number', str(number)):
+            return result
+        logging.warning('По номеру телефона (%s) клиент не найден', number)
 
     def _find_client_w_mail(self, mail):
         '''
         Функция поиска информации о клиенте по электронной почте
         '''
-        logging.info(f'Выполняется поиск информации по адресу электронной почты: {mail}')
-        with self:
-            with self.connection.cursor() as cursor:
-                cursor.execute(f'''
-                                SELECT c.client_id, name, surname, mail, number
-                                FROM client AS c 
-                                LEFT JOIN phone AS p ON c.client_id = p.client_id 
-                                WHERE c.mail = '{mail}';
-                                ''')
-                if result := cursor.fetchall():
-                    return result
-                logging.warning(f'По адресу электронной почты ({mail}) клиент не найден')
+        logging.info('Выполняется поиск информации по адресу электронной почты: %s', mail)
+        if result := self._read(self._fetchall, 'pysql_find_by_mail', mail):
+            return result
+        logging.warning('По адресу электронной почты (%s) клиент не найден', mail)
 
     def _find_client_w_name(self, name, surname):
         '''
         Функция поиска инфомации о клиенте по имени и фамилии
         '''
-        logging.info(f'Выполняется поиск информации по фамилии и имени клиента: {surname} {name}')
-        with self:
-            with self.connection.cursor() as cursor:
-                cursor.execute(f'''
-                                SELECT c.client_id, name, surname, mail, number
-                                FROM client AS c 
-                                LEFT JOIN phone AS p ON c.client_id = p.client_id 
-                                WHERE c.name = '{name}' AND c.surname = '{surname}';
-                                ''')
-                if result := cursor.fetchall():
-                    return result
-                logging.warning(f'По фамилии и имени ({surname} {name}) клиент не найден')
+        logging.info('Выполняется поиск информации по фамилии и имени клиента: %s %s',
+                     surname, name)
+        if result := self._read(self._fetchall, 'pysql_find_by_name', name, surname):
+            return result
+        logging.warning('По фамилии и имени (%s %s) клиент не найден', surname, name)
 
 
-def init_logging():
+def _read_clients(source):
+    '''
+    Функция построчного чтения записей о клиентах из файла CSV/JSONL
+    или итерируемого объекта со словарями params
+    Некорректная строка JSONL возвращается в виде объекта исключения
+    '''
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding='utf-8', newline='') as file:
+            yield from _read_clients(file)
+        return
+    if not hasattr(source, 'read'):
+        yield from source
+        return
+    first = source.readline()
+    if str(getattr(source, 'name', '')).endswith(('.jsonl', '.json')) or first.lstrip().startswith('{'):
+        for line in chain([first], source):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as error:
+                    yield error
+        return
+    for params in csv.DictReader(chain([first], source)):
+        if params.get('number'):
+            params['number'] = re.split(r'[\s,;]+', params['number'].strip())
+        yield params
+
+
+def _rejected(row:int, params, reason:str) -> dict:
+    '''
+    Функция формирования записи отчета об отклоненной записи
+    Для нечитаемой строки JSONL (объекта исключения) вместо params сохраняется текст строки
+    '''
+    if isinstance(params, Exception):
+        params = getattr(params, 'doc', str(params)).strip()
+    return {'row': row, 'params': params, 'reason': reason}
+
+
+@contextmanager
+def _open_target(target):
+    '''
+    Контекстный менеджер открытия файла для выгрузки
+    Переданный открытый файл не закрывается
+    '''
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'w', encoding='utf-8', newline='') as file:
+            yield file
+    else:
+        yield target
+
+
+def _check_clients(records:list) -> list:
+    '''
+    Функция пакетной проверки записей о клиентах перед загрузкой
+    Для каждой записи возвращает кортеж (name, surname, mail, [number, ...])
+    или строку с причиной отказа. Адреса почты и номера телефона всех записей
+    проверяются одним вызовом validate_mails и validate_numbers (номера приводятся
+    к формату столбца "number" - последним 10 цифрам, адреса почты не изменяются)
+    '''
+    results, mails, numbers, owners = [], [], [], []
+    for position, params in enumerate(records):
+        if isinstance(params, Exception):
+            results.append(f'Ошибка чтения записи - {params}')
+            continue
+        try:
+            name, surname, mail = params['name'], params['surname'], params['mail']
+        except (KeyError, TypeError):
+            results.append("Параметры 'name', 'surname' и 'mail' являются обязательными")
+            continue
+        if invalid := [value for value in (name, surname)
+                       if not isinstance(value, str) or not 0 < len(value) <= 30]:
+            results.append(f'Некорректное значение: {invalid[0]!r}')
+            continue
+        if isinstance(client_numbers := params.get('number') or [], (int, str)):
+            client_numbers = [client_numbers]
+        results.append((name.title(), surname.title(), len(mails), len(numbers)))
+        mails.append(mail)
+        numbers.extend(client_numbers)
+        owners.append(len(numbers))
+    checked_mails = validate_mails(mails, unique=False).values
+    checked = validate_numbers(numbers, unique=False).values
+    for position, result in enumerate(results):
+        if isinstance(result, str):
+            continue
+        name, surname, index, start = result
+        end = owners[index]
+        if (mail := checked_mails[index]) is None:
+            results[position] = f'Некорректный адрес почты: {mails[index]!r}'
+        elif denial := [number for number, value in zip(numbers[start:end], checked[start:end])
+                        if value is None]:
+            results[position] = f'Ошибка ввода номера(ов): {', '.join(map(str, denial))}'
+        else:
+            results[position] = name, surname, mail, checked[start:end]
+    return results
+
+
+class InfoSampler(logging.Filter):
+    '''
+    Фильтр сообщений журнала уровня INFO и ниже (сообщения о ходе выполнения методов):
+        sample - доля пропускаемых сообщений (1.0 - все)
+        rate - максимальное количество сообщений в секунду (None - без ограничения)
+    Сообщения уровня WARNING и выше пропускаются всегда
+    Отброшенные сообщения не форматируются; их количество - в атрибуте suppressed
+    '''
+    def __init__(self, sample=1.0, rate=None):
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self.suppressed = 0
+        self._tokens = rate or 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        with self._lock:
+            if self.sample < 1.0 and random() >= self.sample:
+                self.suppressed += 1
+                return False
+            if self.rate is not None:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens < 1:
+                    self.suppressed += 1
+                    return False
+                self._tokens -= 1
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    '''
+    Обработчик журнала, передающий записи в ограниченную очередь фонового потока
+    В вызывающем потоке собирается только текст сообщения (отбор фильтром выполняется
+    до этого), оформление записи выполняется фоновым потоком при записи в файл
+    и консоль; при переполнении очереди
+    запись отбрасывается, количество отброшенных записей - в атрибуте dropped
+    '''
+    def __init__(self, buffer_size:int):
+        super().__init__(queue.Queue(buffer_size))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # аргументы сообщения (например, словари params) могут измениться,
+        # пока запись ждет в очереди, поэтому текст фиксируется сразу
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    '''
+    Настроенный функцией init_logging конвейер журнала
+    Метод stats возвращает количество отброшенных фильтром (suppressed)
+    и из-за переполнения очереди (dropped) сообщений, метод stop -
+    дожидается записи накопленных сообщений и останавливает фоновый поток
+    '''
+    def __init__(self, sampler:InfoSampler, handler=None, listener=None):
+        self.sampler = sampler
+        self.handler = handler
+        self.listener = listener
+
+    def stats(self) -> dict:
+        '''
+        Функция получения статистики конвейера журнала
+        '''
+        return {'suppressed': self.sampler.suppressed,
+                'dropped': self.handler.dropped if self.handler is not None else 0,
+                'queued': self.handler.queue.qsize() if self.handler is not None else 0}
+
+    def stop(self):
+        '''
+        Функция остановки фонового потока записи журнала
+        '''
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+def init_logging(background=False, sample=1.0, rate=None, buffer_size=10000) -> LogPipeline:
     '''
     Функция настройки модуля logging
+    При background = True записи журнала передаются через ограниченную очередь
+    (buffer_size записей) фоновому потоку, который форматирует их и записывает
+    в файл и консоль, не задерживая вызывающий поток
+    Сообщения уровня INFO прореживаются долей sample и ограничиваются
+    rate сообщениями в секунду (см. InfoSampler)
     '''
     log_in_file = logging.FileHandler(r'progress.log', mode='a', encoding='utf-8')
     log_in_console = logging.StreamHandler()
-    logging.basicConfig(level=logging.INFO, handlers=(log_in_console, log_in_file),
-                        format='%(asctime)s %(levelname)s %(message)s')
+    sampler = InfoSampler(sample, rate)
+    if not background:
+        # фильтр корневого журнала: одно решение для консоли и файла, учтенное один раз
+        logging.getLogger().addFilter(sampler)
+        logging.basicConfig(level=logging.INFO, handlers=(log_in_console, log_in_file),
+                            format='%(asctime)s %(levelname)s %(message)s')
+        return LogPipeline(sampler)
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    for handler in log_in_console, log_in_file:
+        handler.setFormatter(formatter)
+    log_in_queue = BoundedQueueHandler(buffer_size)
+    log_in_queue.addFilter(sampler)
+    listener = QueueListener(log_in_queue.queue, log_in_console, log_in_file,
+                             respect_handler_level=True)
+    listener.start()
+    logging.basicConfig(level=logging.INFO, handlers=(log_in_queue,))
+    pipeline = LogPipeline(sampler, log_in_queue, listener)
+    atexit.register(pipeline.stop)
+    return pipeline
+
 
 def rand_info(parameter=None):
     '''
@@ -450,28 +1830,8 @@ def rand_info(parameter=None):
         case 'number':
             return randint(1000000000, 9999999999)
 
-init_logging()
-
-pysql = PySQL(database='pypost', user=config.database_name, password=config.database_password)
-
-info = {
-    # 'client_id': 1,
-    # 'name': rand_info('name'),
-    # 'surname': rand_info('surname'),
-    # 'mail': rand_info('mail'),
-    # 'number': [rand_info('number'), rand_info('number')],
-    # 'new_mail': rand_info('mail'),
-    # 'new_name': rand_info('name'),
-    # 'new_surname': rand_info('surname'),
-    # 'new_number': rand_info('number')
-}
-
-# pysql.delete_table()
-# pysql.create_table()
-
-# pysql.add_client(info)
-# pysql.add_phone(info)
-# pysql.change_client(info)
-# pysql.delete_phone(info)
-# pysql.delete_client(info)
-# pysql.find_client(info)
+
+if __name__ == '__main__':
+    from replay import main
+
+    main()
@@ -0,0 +1,75 @@
+'''
+Версионированные миграции структуры базы данных
+Каждая миграция применяется один раз, номер примененной версии записывается
+в таблицу "schema_version". Миграции с transactional = False выполняются
+вне транзакции (каждый запрос фиксируется сразу) - это необходимо
+для построения индексов без блокировки записи (CREATE INDEX CONCURRENTLY)
+'''
+from collections import namedtuple
+
+Migration = namedtuple('Migration', ('version', 'description', 'statements', 'transactional'))
+
+# Ключ рекомендательной блокировки, исключающей одновременный запуск миграций
+MIGRATION_LOCK = 0x70797371
+
+SCHEMA_VERSION_TABLE = '''
+                       CREATE TABLE IF NOT EXISTS schema_version(
+                           version INTEGER PRIMARY KEY,
+                           description VARCHAR(100) NOT NULL,
+                           applied_at TIMESTAMPTZ NOT NULL DEFAULT now());
+                       '''
+
+MIGRATIONS = (
+    Migration(1, 'Таблицы "client" и "phone"', (
+        '''
+        CREATE TABLE IF NOT EXISTS client(
+            client_id SERIAL primary key,
+            name VARCHAR(30) NOT NULL,
+            surname VARCHAR(30) NOT NULL,
+            mail VARCHAR(30) NOT NULL UNIQUE);
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS phone(
+            phone_id SERIAL primary key,
+            client_id INTEGER REFERENCES client(client_id),
+            number VARCHAR(10) UNIQUE CHECK(char_length(number) = 10));
+        ''',
+    ), True),
+    # Недостроенный (INVALID) индекс от прерванной попытки удаляется перед построением
+    Migration(2, 'Индексы phone(client_id) и client(name, surname)', (
+        'DROP INDEX CONCURRENTLY IF EXISTS phone_client_id_idx;',
+        'CREATE INDEX CONCURRENTLY phone_client_id_idx ON phone(client_id);',
+        'DROP INDEX CONCURRENTLY IF EXISTS client_name_surname_idx;',
+        'CREATE INDEX CONCURRENTLY client_name_surname_idx ON client(name, surname);',
+    ), False),
+    # Ограничение добавляется без проверки существующих строк (NOT VALID),
+    # проверка выполняется следующей миграцией без блокировки записи в "client"
+    Migration(3, 'Каскадное удаление номеров телефона вместе с клиентом', (
+        'ALTER TABLE phone DROP CONSTRAINT IF EXISTS phone_client_id_fkey;',
+        '''
+        ALTER TABLE phone ADD CONSTRAINT phone_client_id_fkey
+            FOREIGN KEY (client_id) REFERENCES client(client_id)
+            ON DELETE CASCADE NOT VALID;
+        ''',
+    ), True),
+    Migration(4, 'Проверка ограничения phone_client_id_fkey', (
+        'ALTER TABLE phone VALIDATE CONSTRAINT phone_client_id_fkey;',
+    ), True),
+)
+
+MIGRATIONS += (
+    Migration(5, 'Расширение pg_trgm', (
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm;',
+    ), True),
+    # Триграммные индексы обслуживают поиск по подстроке и по префиксу (LIKE/ILIKE)
+    Migration(6, 'Триграммные индексы для поиска клиентов', (
+        'DROP INDEX CONCURRENTLY IF EXISTS client_name_trgm_idx;',
+        'CREATE INDEX CONCURRENTLY client_name_trgm_idx ON client USING gin (name gin_trgm_ops);',
+        'DROP INDEX CONCURRENTLY IF EXISTS client_surname_trgm_idx;',
+        'CREATE INDEX CONCURRENTLY client_surname_trgm_idx ON client USING gin (surname gin_trgm_ops);',
+        'DROP INDEX CONCURRENTLY IF EXISTS client_mail_trgm_idx;',
+        'CREATE INDEX CONCURRENTLY client_mail_trgm_idx ON client USING gin (mail gin_trgm_ops);',
+        'DROP INDEX CONCURRENTLY IF EXISTS phone_number_trgm_idx;',
+        'CREATE INDEX CONCURRENTLY phone_number_trgm_idx ON phone USING gin (number gin_trgm_ops);',
+    ), False),
+)
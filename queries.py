@@ -0,0 +1,301 @@
+'''
+Тексты SQL-запросов к таблицам "client" и "phone"
+Запросы записаны с позиционными параметрами $1, $2, ... и подготавливаются
+на сервере (PREPARE) один раз для каждого соединения
+'''
+
+_SELECT_CLIENT = '''
+                 SELECT c.client_id, name, surname, mail, number
+                 FROM client AS c
+                 LEFT JOIN phone AS p ON c.client_id = p.client_id
+                 '''
+
+STATEMENTS = {
+    'pysql_find_by_id': _SELECT_CLIENT + 'WHERE c.client_id = $1',
+    'pysql_find_by_mail': _SELECT_CLIENT + 'WHERE c.mail = $1',
+    'pysql_find_by_number': _SELECT_CLIENT + '''WHERE c.client_id = (SELECT client_id
+                                                                     FROM phone
+                                                                     WHERE number = $1)''',
+    'pysql_find_by_name': _SELECT_CLIENT + 'WHERE c.name = $1 AND c.surname = $2',
+    'pysql_insert_client': '''
+                           INSERT INTO client(name, surname, mail)
+                           VALUES ($1, $2, $3)
+                           RETURNING client_id
+                           ''',
+    'pysql_insert_phone': '''
+                          INSERT INTO phone(client_id, number)
+                          VALUES ($1, $2)
+                          ON CONFLICT (number) DO NOTHING
+                          RETURNING number
+                          ''',
+    'pysql_select_phone_id': 'SELECT phone_id FROM phone WHERE number = $1',
+    'pysql_update_phone': 'UPDATE phone SET number = $1 WHERE phone_id = $2',
+    'pysql_update_client_name': 'UPDATE client SET name = $1 WHERE client_id = $2',
+    'pysql_update_client_surname': 'UPDATE client SET surname = $1 WHERE client_id = $2',
+    'pysql_update_client_mail': 'UPDATE client SET mail = $1 WHERE client_id = $2',
+    'pysql_delete_client_phones': 'DELETE FROM phone WHERE client_id = $1 RETURNING number',
+    'pysql_delete_phone': 'DELETE FROM phone WHERE number = $1 RETURNING number',
+    'pysql_delete_client': 'DELETE FROM client WHERE client_id = $1 RETURNING client_id',
+}
+
+# Множественный поиск: параметр - массив ключей поиска, первые столбцы результата -
+# ключ поиска, по которому найден клиент, номера телефона собираются в массив
+_PHONES_ARRAY = '''ARRAY(SELECT number FROM phone
+                         WHERE phone.client_id = c.client_id
+                         ORDER BY phone_id)'''
+
+STATEMENTS |= {
+    'pysql_find_many_by_client_id': f'''
+                                    SELECT c.client_id, c.client_id, name, surname, mail,
+                                           {_PHONES_ARRAY}
+                                    FROM client AS c
+                                    WHERE c.client_id = ANY($1::integer[])
+                                    ''',
+    'pysql_find_many_by_mail': f'''
+                               SELECT c.mail, c.client_id, name, surname, mail,
+                                      {_PHONES_ARRAY}
+                               FROM client AS c
+                               WHERE c.mail = ANY($1::varchar[])
+                               ''',
+    'pysql_find_many_by_number': f'''
+                                 SELECT p.number, c.client_id, name, surname, mail,
+                                        {_PHONES_ARRAY}
+                                 FROM phone AS p
+                                 JOIN client AS c ON c.client_id = p.client_id
+                                 WHERE p.number = ANY($1::varchar[])
+                                 ''',
+    'pysql_find_many_by_name': f'''
+                               SELECT DISTINCT ON (q.name, q.surname)
+                                      q.name, q.surname, c.client_id, c.name, c.surname, mail,
+                                      {_PHONES_ARRAY}
+                               FROM unnest($1::varchar[], $2::varchar[]) AS q(name, surname)
+                               JOIN client AS c ON c.name = q.name AND c.surname = q.surname
+                               ORDER BY q.name, q.surname, c.client_id
+                               ''',
+}
+
+# Выгрузка клиентов: вместо {where} подставляется условие отбора (или пустая строка),
+# номера телефона собираются подзапросом, чтобы строки возвращались сразу по мере
+# чтения индекса первичного ключа, без предварительной группировки всей таблицы
+ITER_CLIENTS = f'''
+               SELECT c.client_id, name, surname, mail, {_PHONES_ARRAY}
+               FROM client AS c
+               {{where}}
+               ORDER BY c.client_id
+               '''
+
+# Поиск клиентов по подстроке или префиксу: каждая ветвь отбирает по своему триграммному
+# индексу не более %(limit)s идентификаторов клиентов начиная с client_id > %(after)s
+# (ограничение внутри ветви позволяет прервать сканирование индекса на первой странице),
+# ветви объединяются (UNION), после чего берется страница из %(limit)s клиентов
+SEARCH_BRANCHES = {
+    'name': '''(SELECT client_id FROM client
+               WHERE name ILIKE %(pattern)s AND client_id > %(after)s
+               ORDER BY client_id LIMIT %(limit)s)''',
+    'surname': '''(SELECT client_id FROM client
+                  WHERE surname ILIKE %(pattern)s AND client_id > %(after)s
+                  ORDER BY client_id LIMIT %(limit)s)''',
+    'mail': '''(SELECT client_id FROM client
+               WHERE mail ILIKE %(pattern)s AND client_id > %(after)s
+               ORDER BY client_id LIMIT %(limit)s)''',
+    'number': '''(SELECT DISTINCT client_id FROM phone
+                 WHERE number LIKE %(number_pattern)s AND client_id > %(after)s
+                 ORDER BY client_id LIMIT %(limit)s)''',
+}
+
+SEARCH_CLIENTS = f'''
+                 SELECT c.client_id, name, surname, mail, {_PHONES_ARRAY}
+                 FROM (SELECT client_id
+                       FROM ({{matched}}) AS matched
+                       ORDER BY client_id
+                       LIMIT %(limit)s) AS page
+                 JOIN client AS c ON c.client_id = page.client_id
+                 ORDER BY c.client_id
+                 '''
+
+# Синхронизация с полным снимком списка клиентов (sync_clients): снимок загружается
+# командой COPY во временные таблицы, после чего изменения применяются запросами
+# над множествами строк в порядке словаря SYNC_STATEMENTS (ключ - счетчик отчета)
+# Записи снимка, не прошедшие проверку (valid = false), защищают клиента от удаления,
+# но не изменяют его
+SYNC_TABLES = '''
+              DROP TABLE IF EXISTS sync_client, sync_phone;
+              CREATE TEMP TABLE sync_client (
+                  row integer NOT NULL,
+                  name varchar(30),
+                  surname varchar(30),
+                  mail varchar(30) PRIMARY KEY,
+                  valid boolean NOT NULL
+              ) ON COMMIT DROP;
+              CREATE TEMP TABLE sync_phone (
+                  mail varchar(30) NOT NULL,
+                  number varchar(10) PRIMARY KEY
+              ) ON COMMIT DROP;
+              '''
+
+SYNC_COPY_CLIENTS = 'COPY sync_client(row, name, surname, mail, valid) FROM STDIN WITH (FORMAT csv)'
+SYNC_COPY_PHONES = 'COPY sync_phone(mail, number) FROM STDIN WITH (FORMAT csv)'
+
+SYNC_STATEMENTS = {
+    'clients_deleted': '''
+                       DELETE FROM client AS c
+                       WHERE NOT EXISTS (SELECT 1 FROM sync_client AS s WHERE s.mail = c.mail)
+                       ''',
+    'clients_updated': '''
+                       UPDATE client AS c
+                       SET name = s.name, surname = s.surname
+                       FROM sync_client AS s
+                       WHERE s.mail = c.mail AND s.valid
+                         AND (c.name, c.surname) IS DISTINCT FROM (s.name, s.surname)
+                       ''',
+    'clients_inserted': '''
+                        INSERT INTO client(name, surname, mail)
+                        SELECT name, surname, mail
+                        FROM sync_client AS s
+                        WHERE s.valid
+                          AND NOT EXISTS (SELECT 1 FROM client AS c WHERE c.mail = s.mail)
+                        ORDER BY s.row
+                        ''',
+    'phones_moved': '''
+                    UPDATE phone AS p
+                    SET client_id = c.client_id
+                    FROM sync_phone AS sp
+                    JOIN client AS c ON c.mail = sp.mail
+                    WHERE p.number = sp.number AND p.client_id <> c.client_id
+                    ''',
+    'phones_deleted': '''
+                      DELETE FROM phone AS p
+                      USING client AS c
+                      JOIN sync_client AS s ON s.mail = c.mail AND s.valid
+                      WHERE p.client_id = c.client_id
+                        AND NOT EXISTS (SELECT 1
+                                        FROM sync_phone AS sp
+                                        WHERE sp.number = p.number AND sp.mail = c.mail)
+                      ''',
+    'phones_inserted': '''
+                       INSERT INTO phone(client_id, number)
+                       SELECT c.client_id, sp.number
+                       FROM sync_phone AS sp
+                       JOIN client AS c ON c.mail = sp.mail
+                       ON CONFLICT (number) DO NOTHING
+                       ''',
+}
+
+# Параллельная загрузка (loader.py): чтение содержимого базы данных для предварительной
+# проверки уникальности и подтверждение совпадений, найденных фильтром Блума
+LOADER_COUNTS = 'SELECT (SELECT count(*) FROM client), (SELECT count(*) FROM phone)'
+LOADER_ALL_MAILS = 'SELECT mail FROM client'
+LOADER_ALL_NUMBERS = 'SELECT number FROM phone'
+LOADER_EXISTING_MAILS = 'SELECT mail FROM client WHERE mail = ANY(%s::varchar[])'
+LOADER_EXISTING_NUMBERS = 'SELECT number FROM phone WHERE number = ANY(%s::varchar[])'
+
+# Отставание реплики от основного сервера (сек): 0, если сервер не является репликой
+# или все полученные изменения уже применены
+REPLICA_LAG = '''
+              SELECT CASE
+                         WHEN NOT pg_is_in_recovery()
+                              OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                         ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+                     END
+              '''
+
+# Воспроизведение журнала операций (replay.py): каждая операция выполняется одним
+# самостоятельным запросом, не зависящим от результатов предыдущих, поэтому запросы
+# могут отправляться на сервер конвейером (pipeline) без ожидания ответов
+# Запрос возвращает одну строку с результатом в формате JSON или ни одной строки,
+# если клиент не найден; вместо {target} подставляется запрос поиска клиента из REPLAY_TARGETS
+# Конфликты уникальности (ON CONFLICT, NOT EXISTS) не прерывают транзакцию
+REPLAY_TARGETS = {
+    'client_id': 'SELECT client_id FROM client WHERE client_id = %(key)s::integer',
+    'mail': 'SELECT client_id FROM client WHERE mail = %(key)s::varchar',
+    'number': 'SELECT client_id FROM phone WHERE number = %(key)s::varchar',
+    'name': '''SELECT client_id FROM client
+               WHERE name = %(key)s::varchar AND surname = %(key2)s::varchar
+               ORDER BY client_id
+               LIMIT 1''',
+}
+
+REPLAY_STATEMENTS = {
+    'add_client': '''
+                  WITH added AS (
+                      INSERT INTO client(name, surname, mail)
+                      VALUES (%(name)s::varchar, %(surname)s::varchar, %(mail)s::varchar)
+                      ON CONFLICT (mail) DO NOTHING
+                      RETURNING client_id
+                  ), phones AS (
+                      INSERT INTO phone(client_id, number)
+                      SELECT client_id, number
+                      FROM added, unnest(%(numbers)s::varchar[]) AS number
+                      ON CONFLICT (number) DO NOTHING
+                      RETURNING number
+                  )
+                  SELECT json_build_object('client_id', client_id,
+                                           'number', ARRAY(SELECT number FROM phones))
+                  FROM added
+                  ''',
+    'add_phone': '''
+                 WITH target AS ({target}), added AS (
+                     INSERT INTO phone(client_id, number)
+                     SELECT client_id, number
+                     FROM target, unnest(%(numbers)s::varchar[]) AS number
+                     ON CONFLICT (number) DO NOTHING
+                     RETURNING number
+                 )
+                 SELECT json_build_object('client_id', client_id,
+                                          'number', ARRAY(SELECT number FROM added))
+                 FROM target
+                 ''',
+    'change_client': '''
+                     WITH target AS ({target}), changed AS (
+                         UPDATE client AS c
+                         SET name = coalesce(%(new_name)s::varchar, c.name),
+                             surname = coalesce(%(new_surname)s::varchar, c.surname),
+                             mail = coalesce((SELECT %(new_mail)s::varchar
+                                              WHERE NOT EXISTS (SELECT 1 FROM client
+                                                                WHERE mail = %(new_mail)s)),
+                                             c.mail)
+                         FROM target
+                         WHERE c.client_id = target.client_id
+                           AND num_nonnulls(%(new_name)s::varchar, %(new_surname)s::varchar,
+                                            %(new_mail)s::varchar) > 0
+                         RETURNING c.name, c.surname, c.mail
+                     ), renumbered AS (
+                         UPDATE phone AS p
+                         SET number = %(new_number)s::varchar
+                         FROM target
+                         WHERE p.client_id = target.client_id
+                           AND p.number = %(old_number)s::varchar
+                           AND %(new_number)s::varchar IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM phone WHERE number = %(new_number)s)
+                         RETURNING p.number
+                     )
+                     SELECT json_build_object('client_id', client_id,
+                                              'client', (SELECT row_to_json(changed)
+                                                         FROM changed),
+                                              'number', ARRAY(SELECT number FROM renumbered))
+                     FROM target
+                     ''',
+    'delete_phone': '''
+                    WITH deleted AS (
+                        DELETE FROM phone
+                        WHERE number = ANY(%(numbers)s::varchar[])
+                        RETURNING number
+                    )
+                    SELECT json_build_object('number', ARRAY(SELECT number FROM deleted))
+                    ''',
+    'delete_client': '''
+                     WITH target AS ({target})
+                     DELETE FROM client AS c
+                     USING target
+                     WHERE c.client_id = target.client_id
+                     RETURNING json_build_object('client_id', c.client_id)
+                     ''',
+    'find_client': f'''
+                   WITH target AS ({{target}})
+                   SELECT json_build_object('client_id', c.client_id, 'name', name,
+                                            'surname', surname, 'mail', mail,
+                                            'number', {_PHONES_ARRAY})
+                   FROM target
+                   JOIN client AS c ON c.client_id = target.client_id
+                   ''',
+}
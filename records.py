@@ -0,0 +1,106 @@
+'''
+Типизированные записи о клиентах и номерах телефона
+Записи занимают меньше памяти, чем словари (атрибуты хранятся в __slots__),
+и принимаются методами PySQL наравне со словарями params: для совместимости
+значения полей доступны и по ключу (record['mail'], record.get('mail'))
+'''
+
+# Поля записи о клиенте в порядке столбцов запросов
+FIELDS = ('client_id', 'name', 'surname', 'mail', 'number')
+
+
+class Client:
+    '''
+    Запись о клиенте
+        client_id - идентификатор клиента (int)
+        name, surname, mail - имя, фамилия и адрес почты (str)
+        number - номера телефона ([str, ...])
+    '''
+    __slots__ = FIELDS
+
+    def __init__(self, client_id=None, name=None, surname=None, mail=None, number=None):
+        self.client_id = client_id
+        self.name = name
+        self.surname = surname
+        self.mail = mail
+        self.number = number if number is not None else []
+
+    def __repr__(self):
+        return (f'Client(client_id={self.client_id!r}, name={self.name!r}, '
+                f'surname={self.surname!r}, mail={self.mail!r}, number={self.number!r})')
+
+    def __eq__(self, other):
+        if not isinstance(other, Client):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in FIELDS)
+
+    def __getitem__(self, key:str):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key:str, default=None):
+        '''
+        Функция получения значения поля, как у словаря params
+        '''
+        return getattr(self, key, default) if key in FIELDS else default
+
+    def keys(self) -> tuple:
+        '''
+        Функция получения имен полей (для dict(record) и {**record})
+        '''
+        return FIELDS
+
+    def copy(self):
+        '''
+        Функция получения копии записи (со своим списком номеров)
+        '''
+        return Client(self.client_id, self.name, self.surname, self.mail, list(self.number))
+
+    def to_dict(self) -> dict:
+        '''
+        Функция преобразования записи в словарь
+        '''
+        return {field: getattr(self, field) for field in FIELDS}
+
+    @classmethod
+    def from_params(cls, params):
+        '''
+        Функция получения записи из словаря params (запись возвращается как есть)
+        '''
+        if isinstance(params, cls):
+            return params
+        if isinstance(numbers := params.get('number'), (int, str)):
+            numbers = [numbers]
+        return cls(params.get('client_id'), params.get('name'), params.get('surname'),
+                   params.get('mail'), numbers)
+
+
+class Phone:
+    '''
+    Запись о номере телефона
+        number - номер телефона (str, 10 цифр)
+        client_id - идентификатор клиента-владельца (int)
+    '''
+    __slots__ = ('number', 'client_id')
+
+    def __init__(self, number, client_id=None):
+        self.number = number
+        self.client_id = client_id
+
+    def __repr__(self):
+        return f'Phone(number={self.number!r}, client_id={self.client_id!r})'
+
+    def __eq__(self, other):
+        if not isinstance(other, Phone):
+            return NotImplemented
+        return (self.number, self.client_id) == (other.number, other.client_id)
+
+
+def copy_client(result):
+    '''
+    Функция копирования результата поиска (записи Client или словаря)
+    '''
+    if isinstance(result, Client):
+        return result.copy()
+    return {**result, 'number': list(result['number'])}
@@ -0,0 +1,281 @@
+'''
+Воспроизведение журнала операций над базой данных
+Журнал - файл JSONL (или итерируемый объект со словарями), каждая запись которого
+содержит имя операции и словарь params соответствующего метода PySQL:
+    {"op": "add_client", "params": {"name": ..., "surname": ..., "mail": ..., "number": [...]}}
+    {"op": "delete_client", "mail": ...}    (params могут быть указаны прямо в записи)
+Операции add_client, add_phone, change_client, delete_phone, delete_client и find_client
+преобразуются в самостоятельные запросы (см. queries.REPLAY_STATEMENTS), не зависящие
+от результатов друг друга, и выполняются пачками в одной транзакции на пачку.
+При установленной библиотеке psycopg (версии 3) запросы пачки отправляются
+конвейером (pipeline mode) - без ожидания ответа на каждый запрос, иначе -
+последовательно через соединение пула PySQL. Результаты операций выводятся
+в формате JSONL по мере выполнения пачек
+Пример запуска:
+    python main.py operations.jsonl --chunk 1000 --output results.jsonl
+'''
+from itertools import islice
+import argparse
+import json
+import logging
+import sys
+import time
+
+import psycopg2
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+from cache import lookup_key
+from main import PySQL
+from main import _check_clients
+from main import _open_target
+from main import _read_clients
+from queries import REPLAY_STATEMENTS
+from queries import REPLAY_TARGETS
+from validation import validate_numbers
+
+STATUSES = ('ok', 'not_found', 'conflict', 'rejected', 'error')
+
+# Ошибки запросов обоих драйверов; ошибки соединения прерывают воспроизведение
+_ERRORS = (psycopg2.Error, *((psycopg.Error,) if psycopg is not None else ()))
+_CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError,
+                      *((psycopg.OperationalError,) if psycopg is not None else ()))
+
+
+def _numbers(value) -> list:
+    '''
+    Функция приведения значения ключа 'number' / 'new_number' к списку
+    '''
+    if value is None:
+        return []
+    return [value] if isinstance(value, (int, str)) else list(value)
+
+
+def compile_operation(op:str, params) -> tuple:
+    '''
+    Функция преобразования операции журнала в запрос
+    Возвращает кортеж (текст запроса, параметры запроса, отклоненные значения)
+    или строку с причиной отказа (запрос не выполняется)
+    '''
+    if op not in REPLAY_STATEMENTS:
+        return f'Неизвестная операция: {op!r}'
+    if not isinstance(params, dict):
+        return 'Параметры операции должны быть словарем'
+    denial, target = [], ''
+    if op not in ('add_client', 'delete_phone'):
+        if (key := lookup_key(params)) is None:
+            return 'Недостаточно данных для поиска информации о клиенте'
+        target = REPLAY_TARGETS[key[0]]
+        values = {'key': key[1], 'key2': key[2] if len(key) > 2 else None}
+    match op:
+        case 'add_client':
+            if isinstance(checked := _check_clients([params])[0], str):
+                return checked
+            name, surname, mail, numbers = checked
+            values = {'name': name, 'surname': surname, 'mail': mail, 'numbers': numbers}
+        case 'add_phone':
+            checked = validate_numbers(_numbers(params.get('new_number')))
+            if not checked.clean:
+                return f'Нет номеров для добавления: {params.get('new_number')!r}'
+            denial = [f'{value} ({reason})' for _, value, reason in checked.rejected]
+            values['numbers'] = checked.clean
+        case 'change_client':
+            values |= {key: params.get(key) or None
+                       for key in ('new_name', 'new_surname', 'new_mail')}
+            old_number, *_ = _numbers(params.get('number')) or [None]
+            new_number, *_ = _numbers(params.get('new_number')) or [None]
+            if new_number is not None:
+                if old_number is None:
+                    denial.append(f'{new_number} (Не указан заменяемый номер телефона)')
+                elif (number := validate_numbers([new_number]).values[0]) is None:
+                    denial.append(f'{new_number} (Некорректный номер телефона)')
+                else:
+                    values |= {'new_number': number, 'old_number': str(old_number)}
+            values.setdefault('new_number', None)
+            values.setdefault('old_number', None)
+        case 'delete_phone':
+            if not (numbers := _numbers(params.get('number'))):
+                return 'Не указаны номера телефона для удаления'
+            values = {'numbers': [str(number) for number in numbers]}
+    return REPLAY_STATEMENTS[op].format(target=target), values, denial
+
+
+def _pipeline_connection(pysql:PySQL):
+    '''
+    Функция открытия соединения psycopg (версии 3) с параметрами подключения PySQL
+    '''
+    kwargs = dict(pysql.connect_kwargs)
+    return psycopg.connect(kwargs.pop('dsn', ''), autocommit=True, dbname=pysql.database,
+                           user=pysql.user, password=pysql.password, **kwargs)
+
+
+def _execute_pipeline(connection, chunk:list) -> list:
+    '''
+    Функция выполнения пачки запросов конвейером в одной транзакции: запросы
+    отправляются на сервер без ожидания ответов, результаты читаются по завершении
+    Возвращает список строк результата (None - запрос не вернул строк)
+    '''
+    with connection.transaction():
+        with connection.pipeline():
+            cursors = [connection.execute(statement, values)
+                       for _, _, (statement, values, _) in chunk]
+        return [cursor.fetchone() for cursor in cursors]
+
+
+def _execute_sequential(pysql:PySQL, chunk:list, isolate=False) -> list:
+    '''
+    Функция последовательного выполнения пачки запросов через соединение PySQL
+    в одной транзакции. При isolate = True каждый запрос выполняется в точке
+    сохранения, и ошибка запроса возвращается вместо результата (объект исключения),
+    не откатывая остальные запросы пачки
+    '''
+    results = []
+    with pysql:
+        with pysql.connection.cursor() as cursor:
+            for _, _, (statement, values, _) in chunk:
+                if not isolate:
+                    cursor.execute(statement, values)
+                    results.append(cursor.fetchone())
+                    continue
+                try:
+                    with pysql._savepoint(cursor, 'pysql_replay'):
+                        cursor.execute(statement, values)
+                        results.append(cursor.fetchone())
+                except psycopg2.Error as error:
+                    results.append(error)
+            pysql._commit()
+    return results
+
+
+def _execute_chunk(pysql:PySQL, connection, chunk:list) -> list:
+    '''
+    Функция выполнения пачки запросов: конвейером (если передано соединение psycopg)
+    или последовательно. При ошибке пачка откатывается и выполняется повторно
+    с точками сохранения, чтобы ошибка затронула только вызвавшую ее операцию
+    '''
+    try:
+        if connection is not None:
+            return _execute_pipeline(connection, chunk)
+        return _execute_sequential(pysql, chunk)
+    except _ERRORS as error:
+        if isinstance(error, _CONNECTION_ERRORS):
+            raise
+        logging.warning('Ошибка выполнения пачки операций (%s шт.), '
+                        'повтор с точками сохранения - %s', len(chunk), error)
+        return _execute_sequential(pysql, chunk, isolate=True)
+
+
+def _result(row:int, op:str, compiled, result) -> dict:
+    '''
+    Функция формирования результата операции для вывода
+    '''
+    item = {'row': row, 'op': op}
+    if isinstance(compiled, str):
+        return item | {'status': 'rejected', 'reason': compiled}
+    if isinstance(result, Exception):
+        return item | {'status': 'error', 'reason': str(result).strip()}
+    if result is None:
+        if op == 'add_client':
+            return item | {'status': 'conflict', 'reason': 'Адрес почты уже существует'}
+        return item | {'status': 'not_found', 'reason': 'Клиент не найден'}
+    item |= {'status': 'ok', 'result': result[0]}
+    if compiled[2]:
+        item['rejected'] = compiled[2]
+    return item
+
+
+def _operations(source):
+    '''
+    Функция чтения записей журнала операций
+    Возвращает тройки (номер записи, имя операции, запрос или причина отказа)
+    '''
+    for row, record in enumerate(_read_clients(source), 1):
+        if isinstance(record, Exception):
+            yield row, None, f'Ошибка чтения записи - {record}'
+        elif not isinstance(record, dict):
+            yield row, None, 'Запись журнала должна быть словарем'
+        else:
+            op = record.get('op')
+            params = record.get('params', {key: value for key, value in record.items()
+                                           if key != 'op'})
+            yield row, op, compile_operation(op, params)
+
+
+def replay(pysql:PySQL, source, target, chunk_size=500, pipeline=True) -> dict:
+    '''
+    Функция воспроизведения журнала операций
+    Параметр source принимает путь к файлу JSONL, открытый файл или итерируемый
+    объект со словарями, target - путь к файлу или открытый файл для вывода результатов
+    Операции выполняются пачками по chunk_size в одной транзакции на пачку
+    (при pipeline = True и установленной библиотеке psycopg - конвейером),
+    результат каждой операции выводится строкой JSONL:
+        {"row": int, "op": str, "status": "ok" | "not_found" | "conflict" | "rejected" | "error",
+         "result": dict, "reason": str, "rejected": [str, ...]}
+    Возвращает отчет с количеством операций по статусам
+    '''
+    logging.info('Запуск функции (replay) воспроизведения журнала операций: %s '
+                 '(пачками по %s, конвейер - %s)', source, chunk_size,
+                 'да' if pipeline and psycopg is not None else 'нет')
+    report = dict.fromkeys(('operations', *STATUSES), 0)
+    connection = _pipeline_connection(pysql) if pipeline and psycopg is not None else None
+    operations = _operations(source)
+    try:
+        with _open_target(target) as file:
+            while chunk := list(islice(operations, chunk_size)):
+                queued = [item for item in chunk if not isinstance(item[2], str)]
+                results = iter(_execute_chunk(pysql, connection, queued) if queued else ())
+                for row, op, compiled in chunk:
+                    item = _result(row, op, compiled,
+                                   None if isinstance(compiled, str) else next(results))
+                    report['operations'] += 1
+                    report[item['status']] += 1
+                    file.write(json.dumps(item, ensure_ascii=False, default=str) + '\n')
+                file.flush()
+    finally:
+        if connection is not None:
+            connection.close()
+    if pysql.cache is not None:
+        pysql.cache.clear()
+    logging.info('SUCCESS: Воспроизведено операций - %s (%s)', report['operations'],
+                 ', '.join(f'{status}: {report[status]}' for status in STATUSES))
+    return report
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description='Воспроизведение журнала операций (JSONL)')
+    parser.add_argument('source', nargs='?', default='-',
+                        help='файл JSONL с операциями (по-умолчанию - stdin)')
+    parser.add_argument('--database', default='pypost')
+    parser.add_argument('--user', default=config.database_name)
+    parser.add_argument('--password', default=config.database_password)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--chunk', type=int, default=500, help='количество операций в пачке')
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help='выполнять запросы последовательно, без конвейера psycopg')
+    parser.add_argument('--output', help='файл для записи результатов (по-умолчанию - stdout)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(message)s')
+    connect_kwargs = {key: value for key in ('host', 'port')
+                      if (value := getattr(args, key)) is not None}
+    pysql = PySQL(args.database, args.user, args.password, minconn=0, maxconn=1,
+                  **connect_kwargs)
+    start = time.perf_counter()
+    try:
+        report = replay(pysql, sys.stdin if args.source == '-' else args.source,
+                        args.output or sys.stdout, args.chunk, not args.no_pipeline)
+    finally:
+        pysql.close()
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    print(json.dumps(report, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
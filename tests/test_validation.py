@@ -0,0 +1,37 @@
+'''
+Проверка совпадения результатов numpy и Python вариантов пакетной проверки
+'''
+from unittest import mock
+import unittest
+
+import validation
+
+NUMBERS = [9991234567, '+7 (999) 123-45-67', -79991234567, 89991234568, [1], [[1, 2]],
+           {'number': 1}, None, True, 10 ** 40, '9' * 10000, '1' * 33, '123', 9991234567]
+MAILS = ['User@Mail.ru', 'user@MAIL.RU', 'user@mail.ru', 'a@b', None, ['x'], 5,
+         'x' * 10000 + '@mail.ru', 'other@mail.ru']
+
+
+@unittest.skipIf(validation.numpy is None, 'numpy не установлен')
+class TestParity(unittest.TestCase):
+    def check(self, function, values):
+        expected = function(values)
+        with mock.patch.object(validation, 'numpy', None):
+            self.assertEqual(function(values), expected)
+        return expected
+
+    def test_numbers(self):
+        result = self.check(validation.validate_numbers, NUMBERS)
+        self.assertEqual(result.clean, ['9991234567', '9991234568'])
+        self.assertEqual(result.rejected[0], (1, '+7 (999) 123-45-67',
+                                              'Повторяющийся номер телефона'))
+
+    def test_mails(self):
+        result = self.check(validation.validate_mails, MAILS)
+        self.assertEqual(result.clean, ['User@Mail.ru', 'user@MAIL.RU', 'a@b', 'other@mail.ru'])
+        self.assertEqual(result.rejected[0], (2, 'user@mail.ru', 'Повторяющийся адрес почты'))
+        self.assertEqual(result.rejected[-1][1], MAILS[7])
+
+
+if __name__ == '__main__':
+    unittest.main()
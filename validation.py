@@ -0,0 +1,218 @@
+'''
+Пакетная проверка и нормализация номеров телефона, проверка адресов почты
+Значения проверяются целыми массивами до обращения к базе данных: при наличии
+библиотеки numpy - векторными операциями над массивами, иначе - построчно
+средствами Python (результаты обоих вариантов совпадают)
+'''
+from collections import namedtuple
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Допустимое количество цифр номера телефона; в столбце "number" хранятся последние 10 цифр
+NUMBER_DIGITS = (10, 15)
+NUMBER_LENGTH = 10
+MAIL_LENGTH = 30
+# Максимальная длина записи номера (с пробелами, скобками и т.д.): более длинные значения
+# отклоняются до построения массивов, ширина которых равна длине самого длинного значения
+NUMBER_INPUT_LENGTH = 32
+
+_NON_DIGITS = re.compile(r'[^0-9]')
+_SPACES = re.compile(r'[ \t\n\r\x0b\x0c]')
+_SPACE_CODES = tuple(map(ord, ' \t\n\r\x0b\x0c'))
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+# Результат проверки:
+#     values - нормализованные значения в порядке входных данных (None - значение отклонено)
+#     clean - принятые значения без повторов
+#     rejected - отклоненные значения [(позиция, значение, причина), ...]
+Validation = namedtuple('Validation', ('values', 'clean', 'rejected'))
+
+_NUMBER_REASONS = ('Некорректный номер телефона', 'Повторяющийся номер телефона')
+_MAIL_REASONS = ('Некорректный адрес почты', 'Повторяющийся адрес почты')
+
+
+def _numbers_python(values:list, unique:bool) -> Validation:
+    '''
+    Функция нормализации номеров телефона средствами Python
+    '''
+    normalized = []
+    for value in values:
+        digits = _NON_DIGITS.sub('', str(value))
+        normalized.append(digits[-NUMBER_LENGTH:]
+                          if NUMBER_DIGITS[0] <= len(digits) <= NUMBER_DIGITS[1] else None)
+    return _result_python(values, normalized, unique, *_NUMBER_REASONS)
+
+
+def _numbers_numpy(values:list, unique:bool) -> Validation:
+    '''
+    Функция нормализации номеров телефона векторными операциями numpy
+    Целые числа проверяются арифметически; строки представляются матрицей кодов
+    символов, и значение номера собирается из последних NUMBER_LENGTH цифр строки
+    с весами-степенями 10. Повторы ищутся по числовому значению номера
+    '''
+    array = numpy.array(values)
+    if array.dtype.kind in 'iu':
+        magnitude = numpy.abs(array.astype(numpy.int64))
+        valid = ((magnitude >= 10 ** (NUMBER_DIGITS[0] - 1))
+                 & (magnitude < 10 ** NUMBER_DIGITS[1]))
+        keys = magnitude % 10 ** NUMBER_LENGTH
+    else:
+        if array.dtype.kind != 'U':
+            array = numpy.array([str(value) for value in values])
+        # коды символов за вычетом кода '0': цифрам соответствуют значения 0-9
+        codes = array.view(numpy.uint32).reshape(len(array), -1) - ord('0')
+        digit = codes < 10
+        count = digit.sum(axis=1)
+        valid = (count >= NUMBER_DIGITS[0]) & (count <= NUMBER_DIGITS[1])
+        # порядковый номер цифры, считая с конца строки (1 - последняя цифра)
+        rank = numpy.cumsum(digit[:, ::-1], axis=1, dtype=numpy.int32)[:, ::-1]
+        powers = numpy.concatenate(([0], 10 ** numpy.arange(NUMBER_LENGTH, dtype=numpy.int64)))
+        keys = (codes * powers[numpy.where(digit & (rank <= NUMBER_LENGTH), rank, 0)]).sum(axis=1)
+    digits = keys[:, None] // 10 ** numpy.arange(NUMBER_LENGTH - 1, -1, -1) % 10 + ord('0')
+    numbers = digits.astype(numpy.uint32).view(f'U{NUMBER_LENGTH}').ravel()
+    return _result_numpy(values, numbers, keys, valid, unique, *_NUMBER_REASONS)
+
+
+def _mails_python(values:list, unique:bool) -> Validation:
+    '''
+    Функция проверки адресов почты средствами Python
+    '''
+    accepted, keys = [], []
+    for value in values:
+        mail = key = None
+        if isinstance(value, str):
+            local, _, domain = value.partition('@')
+            if (local and domain and '@' not in domain and len(value) <= MAIL_LENGTH
+                    and not _SPACES.search(value)):
+                mail, key = value, f'{local}@{domain.translate(_ASCII_LOWER)}'
+        accepted.append(mail)
+        keys.append(key)
+    return _result_python(values, accepted, unique, *_MAIL_REASONS, keys=keys)
+
+
+def _mails_numpy(values:list, unique:bool) -> Validation:
+    '''
+    Функция проверки адресов почты векторными операциями numpy
+    над матрицей кодов символов адресов
+    '''
+    strings = numpy.array([value if isinstance(value, str) else '' for value in values])
+    codes = strings.view(numpy.uint32).reshape(len(strings), -1).copy()
+    length = numpy.char.str_len(strings)
+    at = codes == ord('@')
+    position = at.argmax(axis=1)
+    valid = ((at.sum(axis=1) == 1) & (position > 0) & (position < length - 1)
+             & (length <= MAIL_LENGTH) & ~numpy.isin(codes, _SPACE_CODES).any(axis=1))
+    # ключ повтора: латинские прописные буквы доменной части приводятся к строчным
+    domain = numpy.arange(codes.shape[1]) > position[:, None]
+    codes[domain & (codes >= ord('A')) & (codes <= ord('Z'))] += ord('a') - ord('A')
+    keys = codes.view(strings.dtype).ravel()
+    return _result_numpy(values, strings, keys, valid, unique, *_MAIL_REASONS)
+
+
+def _result_python(values:list, normalized:list, unique:bool, invalid:str, repeated:str,
+                   keys=None):
+    '''
+    Функция сборки результата проверки (Validation) с поиском повторов по множеству
+    ключей keys (по-умолчанию - нормализованных значений)
+    '''
+    keys = keys or normalized
+    clean, rejected, seen = [], [], set()
+    for position, value in enumerate(values):
+        if (item := normalized[position]) is None:
+            rejected.append((position, value, invalid))
+        elif unique and keys[position] in seen:
+            normalized[position] = None
+            rejected.append((position, value, repeated))
+        else:
+            seen.add(keys[position])
+            clean.append(item)
+    return Validation(normalized, clean, rejected)
+
+
+def _result_numpy(values:list, normalized, keys, valid, unique:bool, invalid:str, repeated:str):
+    '''
+    Функция сборки результата проверки (Validation) из массивов numpy
+    Повтором считается допустимое значение, ключ которого (keys) встречался раньше
+    '''
+    accepted = valid.copy()
+    if unique and (positions := numpy.flatnonzero(valid)).size:
+        if keys.dtype.kind == 'U':
+            # строки быстрее сравниваются хэшированием, чем сортировкой: при обходе
+            # с конца в словаре остается позиция первого вхождения ключа
+            first = list(dict(zip(reversed(keys[positions].tolist()),
+                                  reversed(positions.tolist()))).values())
+        else:
+            first = positions[numpy.unique(keys[positions], return_index=True)[1]]
+        accepted[positions] = False
+        accepted[first] = True
+    rejected = [(position, values[position], repeated if valid[position] else invalid)
+                for position in numpy.flatnonzero(~accepted).tolist()]
+    return Validation(numpy.where(accepted, normalized, None).tolist(),
+                      normalized[accepted].tolist(), rejected)
+
+
+def _prepare(values:list, accept) -> tuple:
+    '''
+    Функция предварительного отбора значений: значения, не прошедшие проверку accept
+    (другого типа или слишком длинные), заменяются пустой строкой и далее отклоняются
+    обоими вариантами проверки одинаково
+    Возвращает кортеж (подготовленные значения, признак замены значений)
+    '''
+    prepared = [value if accept(value) else '' for value in values]
+    return prepared, any(item is not value for item, value in zip(prepared, values))
+
+
+def _restore(values:list, result:Validation, replaced:bool) -> Validation:
+    '''
+    Функция возврата исходных значений в список отклоненных значений результата
+    '''
+    if not replaced:
+        return result
+    return result._replace(rejected=[(position, values[position], reason)
+                                     for position, _, reason in result.rejected])
+
+
+def _number_input(value) -> bool:
+    if isinstance(value, str):
+        return len(value) <= NUMBER_INPUT_LENGTH
+    return isinstance(value, int) and abs(value) < 10 ** NUMBER_INPUT_LENGTH
+
+
+def _mail_input(value) -> bool:
+    return isinstance(value, str) and len(value) <= MAIL_LENGTH
+
+
+def validate_numbers(values, unique=True) -> Validation:
+    '''
+    Функция пакетной проверки номеров телефона
+    Номер (int или str в любом формате, например "+7 (999) 123-45-67") допустим,
+    если содержит от 10 до 15 цифр, и приводится к формату столбца "number" -
+    последним 10 цифрам. При unique = True повторы номера отклоняются
+    Значения другого типа и длиннее NUMBER_INPUT_LENGTH символов отклоняются
+    '''
+    values = list(values)
+    if not values:
+        return Validation([], [], [])
+    prepared, replaced = _prepare(values, _number_input)
+    result = (_numbers_numpy if numpy is not None else _numbers_python)(prepared, unique)
+    return _restore(values, result, replaced)
+
+
+def validate_mails(values, unique=True) -> Validation:
+    '''
+    Функция пакетной проверки адресов почты
+    Адрес допустим, если содержит ровно один символ "@" между непустыми частями,
+    не содержит пробелов и не длиннее 30 символов. Допустимые адреса возвращаются
+    без изменений (как хранятся и ищутся в базе данных), а при unique = True
+    отклоняются повторы адреса без учета регистра латинских букв доменной части
+    '''
+    values = list(values)
+    if not values:
+        return Validation([], [], [])
+    prepared, replaced = _prepare(values, _mail_input)
+    result = (_mails_numpy if numpy is not None else _mails_python)(prepared, unique)
+    return _restore(values, result, replaced)